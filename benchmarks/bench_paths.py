@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Micro-benchmark for path resolution.
+#
+# Fills a scratch collection on a local mongod and reports how many
+# callbacks per second Humongoufs can resolve, compared with parsing the
+# path and building fresh mongo_objects on every call as it used to.
+#
+#   python benchmarks/bench_paths.py [-h host] [-p port] [-n docs] [-t seconds]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'humongoufs'))
+
+import mongo_objects
+from humongoufs import Humongoufs, findOpt
+
+DB = 'humongoufs_bench'
+COL = 'paths'
+
+def legacyResolve(conn, path):
+    pp = [s for s in path.split('/') if s]
+    if not pp:
+        return mongo_objects.Mongo(conn)
+    elif len(pp) == 1:
+        return mongo_objects.Database(conn, pp[0])
+    elif len(pp) == 2:
+        return mongo_objects.Collection(conn, pp[0], pp[1])
+    return mongo_objects.Document(conn, pp[0], pp[1], pp[2])
+
+def rate(func, paths, seconds):
+    calls = 0
+    start = time.time()
+    end = start + seconds
+    while time.time() < end:
+        for path in paths:
+            func(path)
+        calls += len(paths)
+    return calls / (time.time() - start)
+
+if __name__ == '__main__':
+    argv = sys.argv
+    host, port, docs, seconds = 'localhost', 27017, 1000, 2.0
+    idx = findOpt('-h', argv)
+    if idx > 0:
+        host = argv[idx]
+    idx = findOpt('-p', argv)
+    if idx > 0:
+        port = int(argv[idx])
+    idx = findOpt('-n', argv)
+    if idx > 0:
+        docs = int(argv[idx])
+    idx = findOpt('-t', argv)
+    if idx > 0:
+        seconds = float(argv[idx])
+
+    fs = Humongoufs(host, port)
+    collection = fs.conn[DB][COL]
+    collection.drop()
+    collection.insert([{'data' : 'x' * 64} for i in range(docs)])
+    docPaths = ['/%s/%s/%s' % (DB, COL, name) for name in
+                fs.getObjectFromPath('/%s/%s' % (DB, COL)).readdir()[2:]]
+    dirPaths = ['/', '/' + DB, '/%s/%s' % (DB, COL)]
+
+    try:
+        for label, paths in (('directories', dirPaths), ('documents', docPaths)):
+            legacy = rate(lambda p: legacyResolve(fs.conn, p), paths, seconds)
+            table = rate(fs.getObjectFromPath, paths, seconds)
+            print '%-12s legacy %10.0f/s   path table %10.0f/s   (x%.1f)' % (
+                label, legacy, table, table / legacy)
+        getattr_rate = rate(fs.getattr, docPaths, seconds)
+        print '%-12s %10.0f/s with a warm document cache' % ('getattr', getattr_rate)
+    finally:
+        fs.conn.drop_database(DB)
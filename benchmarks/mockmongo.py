@@ -0,0 +1,46 @@
+# mongomock stand-in for a local mongod
+#
+# Adapts mongomock to the parts of the pymongo 2.x API that Humongoufs
+# uses, so the benchmarks can run where no mongod is available.  The
+# numbers measure Humongoufs overhead only; there is no network.
+
+import datetime
+
+import mongomock
+from mongomock.collection import Collection
+from mongomock.database import Database
+
+def _find(find):
+    def wrapper(self, spec=None, fields=None, *args, **kwargs):
+        return find(self, spec, fields, *args, **kwargs)
+    return wrapper
+
+def _insert(insert):
+    def wrapper(self, doc_or_docs, safe=False, **kwargs):
+        return insert(self, doc_or_docs)
+    return wrapper
+
+def _command(self, command, value=None, **kwargs):
+    if command == 'serverStatus':
+        return {'backgroundFlushing' :
+                    {'last_finished' : datetime.datetime.now()}}
+    if command == 'collStats':
+        count = self[value].count()
+        return {'count' : count, 'size' : count * 64,
+                'storageSize' : count * 64}
+    if command.lower() == 'dbstats':
+        return {'collections' : len(self.collection_names()),
+                'objects' : 0, 'dataSize' : 0, 'storageSize' : 0,
+                'fileSize' : 0}
+    raise NotImplementedError(command)
+
+Collection.find = _find(Collection.find)
+Collection.insert = _insert(Collection.insert)
+Database.command = _command
+
+class MockConnection(mongomock.MongoClient):
+    def __init__(self, *args, **kwargs):
+        mongomock.MongoClient.__init__(self)
+
+    def disconnect(self):
+        pass
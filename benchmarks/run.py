@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Runs the standard workloads and writes the results as JSON.
+#
+#   python benchmarks/run.py                       # in-process, local mongod
+#   python benchmarks/run.py --mock                # in-process, mongomock
+#   python benchmarks/run.py --mount /tmp/mnt      # through a real mount
+#   python benchmarks/run.py --full -o out.json    # 100k and 1M listings too
+#   python benchmarks/run.py -N ns.json            # startup from a namespace file
+#
+# Keep the JSON files around and compare them between revisions to catch
+# regressions in the Humongoufs callbacks.
+
+import argparse
+import json
+import socket
+import sys
+import time
+
+from targets import DirectTarget, MountTarget
+import workloads
+
+SMALL = {
+    'ls_sizes' : [1000, 10000],
+    'cat_sizes' : [1024, 64 * 1024, 1024 * 1024, 15 * 1024 * 1024]
+    }
+FULL = {
+    'ls_sizes' : [1000, 100000, 1000000],
+    'cat_sizes' : SMALL['cat_sizes']
+    }
+
+def plan(scale):
+    runs = []
+    for count in scale['ls_sizes']:
+        runs.append(('ls_l_%d' % count, workloads.ls_l, {'count' : count}))
+    for size in scale['cat_sizes']:
+        runs.append(('cat_%d' % size, workloads.cat, {'size' : size}))
+    runs.append(('cp_in', workloads.cp_in, {}))
+    runs.append(('cp_out', workloads.cp_out, {}))
+    runs.append(('parallel_readers', workloads.parallel_readers, {}))
+    runs.append(('editor_save', workloads.editor_save, {}))
+    return runs
+
+def main():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-h', '--host', default='localhost',
+                        help='host name or mongodb:// connection string')
+    parser.add_argument('-p', '--port', type=int, default=27017)
+    parser.add_argument('--mock', action='store_true',
+                        help='use mongomock instead of a mongod')
+    parser.add_argument('--mount', metavar='DIR',
+                        help='benchmark through a real mount at DIR')
+    parser.add_argument('--full', action='store_true',
+                        help='include the 100k and 1M document listings')
+    parser.add_argument('-N', '--namespace', metavar='FILE',
+                        help='start up from this namespace file')
+    parser.add_argument('--only', help='comma separated workload names')
+    parser.add_argument('-o', '--output', help='JSON output file')
+    parser.add_argument('--help', action='help')
+    args = parser.parse_args()
+
+    if args.mock:
+        from mockmongo import MockConnection
+        conn = MockConnection()
+    else:
+        from connection import connect
+        conn, router = connect(args.host, args.port)
+
+    if args.mount:
+        options = ['-h', args.host, '-p', str(args.port)]
+        if args.namespace:
+            options += ['-N', args.namespace]
+        target = MountTarget(args.mount, options)
+    elif args.mock:
+        target = DirectTarget(conn, namespace=args.namespace)
+    else:
+        # Its own connection, so that connecting counts towards startup
+        target = DirectTarget(None, args.host, args.port,
+                              namespace=args.namespace)
+
+    results = {
+        'timestamp' : time.time(),
+        'host' : socket.gethostname(),
+        'target' : target.name,
+        'mongo' : 'mock' if args.mock else (
+            args.host if args.host.startswith('mongodb://') else
+            '%s:%d' % (args.host, args.port)),
+        'workloads' : {}
+        }
+    if args.mount:
+        results['mount_s'] = target.mountTime
+    results['time_to_first_op_s'] = target.firstOpTime
+
+    only = args.only.split(',') if args.only else None
+    try:
+        for name, workload, options in plan(FULL if args.full else SMALL):
+            if only and name not in only:
+                continue
+            rec = workloads.Recorder(target)
+            workload(rec, target, conn, **options)
+            summary = rec.summary()
+            results['workloads'][name] = summary
+            print >>sys.stderr, '%-20s %8d ops %10.1f ops/s' % (
+                name, summary['ops'], summary['ops_per_s'])
+    finally:
+        target.close()
+        conn.drop_database(workloads.DB)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# Benchmark targets
+#
+# A target exposes the handful of file operations the workloads need.
+# DirectTarget drives the Humongoufs callbacks in-process, in the order the
+# kernel would issue them, so it runs without FUSE and can use a mock
+# database.  MountTarget starts a real mount and goes through the kernel.
+
+import errno
+import os
+import re
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, '..', 'humongoufs')
+sys.path.insert(0, SOURCE)
+
+CHUNK = 128 * 1024
+
+class DirectTarget:
+    name = 'direct'
+
+    def __init__(self, conn, host=None, port=None, **options):
+        from humongoufs import Humongoufs
+        # Time to first op runs from construction (connecting, unless conn
+        # is given) to a listing of the root
+        start = time.time()
+        self.fs = Humongoufs(host, port, conn=conn, **options)
+        self.fs.init('/')
+        self.fs.getattr('/')
+        self.fs.readdir('/', 0)
+        self.firstOpTime = time.time() - start
+
+    def close(self):
+        pass
+
+    def resetTrips(self):
+        import tracing
+        tracing.reset()
+
+    def trips(self):
+        import tracing
+        return tracing.roundtrips()
+
+    def listdir(self, path):
+        return [n for n in self.fs.readdir(path, 0) if n not in ('.', '..')]
+
+    def stat(self, path):
+        return self.fs.getattr(path)
+
+    def exists(self, path):
+        try:
+            self.fs.getattr(path)
+            return True
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+    def readfile(self, path):
+        fs = self.fs
+        size = fs.getattr(path)['st_size']
+        fh = fs.open(path, os.O_RDONLY)
+        chunks = []
+        offset = 0
+        while True:
+            data = fs.read(path, CHUNK, offset, fh)
+            if not data:
+                break
+            chunks.append(data)
+            offset += len(data)
+            if offset >= size:
+                break
+        fs.flush(path, fh)
+        fs.release(path, fh)
+        return ''.join(chunks)
+
+    def writefile(self, path, data):
+        fs = self.fs
+        if self.exists(path):
+            fh = fs.open(path, os.O_WRONLY | os.O_TRUNC)
+            fs.truncate(path, 0, fh)
+        else:
+            fh = fs.create(path, 0644)
+        for offset in xrange(0, max(1, len(data)), CHUNK):
+            fs.write(path, data[offset:offset + CHUNK], offset, fh)
+        fs.flush(path, fh)
+        fs.release(path, fh)
+
+    def rename(self, old, new):
+        self.fs.rename(old, new)
+
+    def unlink(self, path):
+        self.fs.unlink(path)
+
+    def mkdir(self, path):
+        self.fs.mkdir(path, 0755)
+
+class MountTarget:
+    """Mounts Humongoufs on mountpoint in a child process.  Round trips are
+       taken from the fuse op table in the mount's /.stats file."""
+
+    name = 'mount'
+
+    def __init__(self, mountpoint, args=()):
+        self.mountpoint = os.path.abspath(mountpoint)
+        if not os.path.isdir(self.mountpoint):
+            os.makedirs(self.mountpoint)
+        start = time.time()
+        self.proc = subprocess.Popen([sys.executable,
+                                      os.path.join(SOURCE, 'humongoufs.py'),
+                                      self.mountpoint, '-f'] + list(args))
+        while not os.path.ismount(self.mountpoint):
+            if self.proc.poll() is not None:
+                raise RuntimeError('humongoufs exited with %d' %
+                                   self.proc.returncode)
+            time.sleep(0.01)
+        self.mountTime = time.time() - start
+        os.stat(self.mountpoint)
+        os.listdir(self.mountpoint)
+        self.firstOpTime = time.time() - start
+
+    def close(self):
+        subprocess.call(['fusermount', '-u', self.mountpoint])
+        self.proc.wait()
+
+    def resetTrips(self):
+        pass
+
+    def trips(self):
+        return None
+
+    def fuseOps(self):
+        """Returns {op: (count, round trips)} from /.stats"""
+        ops = {}
+        with open(self._path('/.stats')) as f:
+            for line in f:
+                m = re.match(r'^(\w+)\s+(\d+)\s+\S+ms\s+\S+ms\s+\S+ms\s+([\d.]+)$',
+                             line.strip())
+                if m:
+                    count = int(m.group(2))
+                    ops[m.group(1)] = (count, count * float(m.group(3)))
+        return ops
+
+    def listdir(self, path):
+        return os.listdir(self._path(path))
+
+    def stat(self, path):
+        return os.lstat(self._path(path))
+
+    def exists(self, path):
+        return os.path.exists(self._path(path))
+
+    def readfile(self, path):
+        with open(self._path(path), 'rb') as f:
+            return f.read()
+
+    def writefile(self, path, data):
+        with open(self._path(path), 'wb') as f:
+            f.write(data)
+
+    def rename(self, old, new):
+        os.rename(self._path(old), self._path(new))
+
+    def unlink(self, path):
+        os.unlink(self._path(path))
+
+    def mkdir(self, path):
+        os.mkdir(self._path(path))
+
+    def _path(self, path):
+        return self.mountpoint + path
@@ -0,0 +1,180 @@
+# Standard workloads
+#
+# Each workload takes a Recorder and a Target, seeds what it needs straight
+# through the driver and then times the file operations a familiar tool
+# would make.
+
+from collections import defaultdict
+
+import random
+import shutil
+import tempfile
+import threading
+import time
+import os
+
+DB = 'humongoufs_bench'
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Recorder:
+    """Times every operation a workload performs against a target"""
+
+    def __init__(self, target):
+        self.target = target
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.trips = defaultdict(int)
+        self.started = None
+        self.fuseOps = target.fuseOps() if hasattr(target, 'fuseOps') else None
+
+    def __call__(self, op, *args):
+        target = self.target
+        target.resetTrips()
+        start = time.time()
+        if self.started is None:
+            # Seeding happens before the first operation and is not timed
+            self.started = start
+        try:
+            return getattr(target, op)(*args)
+        finally:
+            latency = time.time() - start
+            trips = target.trips()
+            with self.lock:
+                self.samples[op].append(latency)
+                if trips is not None:
+                    self.trips[op] += trips
+
+    def summary(self):
+        elapsed = time.time() - (self.started or time.time())
+        total = sum(len(s) for s in self.samples.values())
+        result = {
+            'elapsed_s' : elapsed,
+            'ops' : total,
+            'ops_per_s' : total / elapsed if elapsed else 0.0,
+            'by_op' : {}
+            }
+        for op, samples in self.samples.items():
+            stats = {
+                'count' : len(samples),
+                'p50_ms' : 1000 * percentile(samples, 0.5),
+                'p99_ms' : 1000 * percentile(samples, 0.99)
+                }
+            if op in self.trips:
+                stats['roundtrips_per_op'] = float(self.trips[op]) / len(samples)
+            result['by_op'][op] = stats
+        if self.fuseOps is not None:
+            # Only the kernel sees individual callbacks on a real mount
+            after = self.target.fuseOps()
+            result['fuse_ops'] = {}
+            for op, (count, trips) in after.items():
+                count0, trips0 = self.fuseOps.get(op, (0, 0.0))
+                if count > count0:
+                    result['fuse_ops'][op] = {
+                        'count' : count - count0,
+                        'roundtrips_per_op' : (trips - trips0) / (count - count0)
+                        }
+        return result
+
+'''Seeding'''
+def seed(conn, col, count, size):
+    """Fills DB.col with count documents of roughly size bytes, unless it
+       already holds them from an earlier run."""
+    collection = conn[DB][col]
+    if collection.count() == count:
+        return
+    collection.drop()
+    body = 'x' * size
+    batch = []
+    for i in xrange(count):
+        batch.append({'data' : body})
+        if len(batch) == 1000:
+            collection.insert(batch)
+            batch = []
+    if batch:
+        collection.insert(batch)
+
+def names(target, col):
+    return target.listdir('/%s/%s' % (DB, col))
+
+'''Workloads'''
+def ls_l(rec, target, conn, count):
+    """ls -l on a collection of count documents"""
+    col = 'ls_%d' % count
+    seed(conn, col, count, 16)
+    path = '/%s/%s' % (DB, col)
+    rec('stat', path)
+    for name in rec('listdir', path):
+        rec('stat', path + '/' + name)
+
+def cat(rec, target, conn, size, count=5):
+    """Sequential cat of count documents of size bytes"""
+    col = 'cat_%d' % size
+    seed(conn, col, count, size)
+    for name in names(target, col):
+        rec('readfile', '/%s/%s/%s' % (DB, col, name))
+
+def cp_in(rec, target, conn, count=200, size=4096):
+    """cp -r of a local directory of count files into a collection"""
+    conn[DB].drop_collection('cp')
+    conn[DB].create_collection('cp')
+    local = tempfile.mkdtemp()
+    try:
+        for i in xrange(count):
+            with open(os.path.join(local, 'file%d' % i), 'wb') as f:
+                f.write(('%d ' % i) * (size // 4))
+        for name in os.listdir(local):
+            with open(os.path.join(local, name), 'rb') as f:
+                data = f.read()
+            path = '/%s/cp/%s' % (DB, name)
+            rec('exists', path)
+            rec('writefile', path, data)
+    finally:
+        shutil.rmtree(local)
+
+def cp_out(rec, target, conn):
+    """cp -r of the collection written by cp_in to a local directory"""
+    local = tempfile.mkdtemp()
+    try:
+        path = '/%s/cp' % DB
+        for name in rec('listdir', path):
+            rec('stat', path + '/' + name)
+            data = rec('readfile', path + '/' + name)
+            with open(os.path.join(local, name), 'wb') as f:
+                f.write(data)
+    finally:
+        shutil.rmtree(local)
+
+def parallel_readers(rec, target, conn, threads=8, reads=200):
+    """threads readers opening random 1 KB documents"""
+    col = 'cat_1024'
+    seed(conn, col, 1000, 1024)
+    paths = ['/%s/%s/%s' % (DB, col, name) for name in names(target, col)]
+    def reader():
+        for i in xrange(reads):
+            rec('readfile', random.choice(paths))
+    workers = [threading.Thread(target=reader) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def editor_save(rec, target, conn, saves=50):
+    """The sequence vim goes through when saving a file: swap file, backup
+       by rename, rewrite, clean up"""
+    conn[DB].drop_collection('editor')
+    conn[DB].create_collection('editor')
+    base = '/%s/editor/' % DB
+    rec('writefile', base + 'notes', '{"text": ""}')
+    for i in xrange(saves):
+        rec('exists', base + '.notes.swp')
+        rec('writefile', base + '.notes.swp', 'swap %d' % i)
+        rec('rename', base + 'notes', base + 'notes~')
+        rec('writefile', base + 'notes', '{"text": "revision %d"}' % i)
+        rec('stat', base + 'notes')
+        rec('unlink', base + 'notes~')
+        rec('unlink', base + '.notes.swp')
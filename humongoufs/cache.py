@@ -0,0 +1,286 @@
+# Document caching and sequential readahead for collection scans
+
+from Queue import Queue
+from bson.son import SON
+from collections import OrderedDict
+from tracing import call
+
+import bson
+import ids
+import threading
+import time
+
+class DocumentCache:
+    """Bounded LRU cache of raw documents keyed by (db, col, filename).
+       Entries expire after ttl seconds so that changes made by other
+       clients eventually become visible.  The cache holds at most
+       maxEntries documents and maxBytes of BSON, whichever is hit first.
+
+       disk, a DiskCache, is an optional second tier that misses fall
+       through to and that every document put here is written to.  It
+       serves a copy for no longer than ttl after confirming it current."""
+
+    def __init__(self, maxEntries=4096, ttl=10.0, maxBytes=256 << 20,
+                 disk=None):
+        self.disk = disk
+        if disk:
+            disk.validFor = min(disk.validFor, ttl)
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.bytes = 0
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetchHits = 0
+
+    def get(self, key):
+        """Returns a copy of the cached document, or None on a miss."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    self.bytes -= entry[3]
+                entry = None
+            else:
+                self.entries[key] = entry
+        if entry is None:
+            doc = self.disk and self.disk.get(key)
+            if doc is not None:
+                self.put(key, doc, disk=False)
+            with self.lock:
+                self.misses += 1
+            return doc
+        with self.lock:
+            self.hits += 1
+            if entry[2]:
+                entry[2] = False
+                self.prefetchHits += 1
+            return SON(entry[0])
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[1] >= time.time()
+
+    def put(self, key, doc, prefetched=False, disk=True):
+        if disk and self.disk:
+            self.disk.put(key, doc)
+        try:
+            size = len(bson.BSON.encode(doc))
+        except Exception:
+            size = len(repr(doc))
+        with self.lock:
+            self._remove(key)
+            if size > self.maxBytes:
+                # Too big to keep in memory, but the disk copy still serves
+                return
+            self.entries[key] = [SON(doc), time.time() + self.ttl, prefetched,
+                                 size]
+            self.bytes += size
+            while (len(self.entries) > self.maxEntries or
+                   self.bytes > self.maxBytes):
+                self.bytes -= self.entries.popitem(last=False)[1][3]
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+        if self.disk:
+            self.disk.invalidate(key)
+
+    def validate(self, key, field, value):
+        """Drops the entry for key unless its document has value in field."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0].get(field) != value:
+                self._remove(key)
+        if self.disk:
+            self.disk.validate(key, value)
+
+    def invalidateCollection(self, db, col=None):
+        """Drops every document of db.col, or of all of db when col is
+           None, as when they are dropped."""
+        with self.lock:
+            for key in [k for k in self.entries if _within(k, db, col)]:
+                self._remove(key)
+        if self.disk:
+            self.disk.invalidateCollection(db, col)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries' : len(self.entries),
+            'bytes' : self.bytes,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : float(self.hits) / lookups if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+class Prefetcher:
+    """Watches document accesses against the last listing of each
+       collection.  Once accesses walk the listing in order, the next
+       `depth` documents are fetched with a single $in query on a
+       background thread and placed in the document cache.
+
+       The depth adapts: it doubles while prefetched documents are being
+       consumed and halves whenever the sequential run is broken."""
+
+    def __init__(self, conn, cache, depth=16, maxDepth=512):
+        self.conn = conn
+        self.cache = cache
+        self.minDepth = max(1, depth)
+        self.maxDepth = max(self.minDepth, maxDepth)
+        self.lock = threading.Lock()
+        self.listings = {}
+        self.cursors = {}
+        self.queue = Queue()
+        self.issued = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def listed(self, db, col, names):
+        """Records the order in which a collection was last listed."""
+        index = dict((name, i) for i, name in enumerate(names))
+        with self.lock:
+            self.listings[(db, col)] = (names, index)
+            self.cursors[(db, col)] = [-1, 0, self.minDepth, -1]
+
+    def accessed(self, db, col, name):
+        """Called for every document lookup.  Schedules a prefetch when the
+           access continues a sequential run over the listing."""
+        ns = (db, col)
+        with self.lock:
+            listing = self.listings.get(ns)
+            if listing is None:
+                return
+            names, index = listing
+            pos = index.get(name)
+            if pos is None:
+                return
+            # cursor: [last position, run length, depth, prefetched up to]
+            cursor = self.cursors[ns]
+            if pos == cursor[0]:
+                # getattr and then read of the same document
+                return
+            if pos == cursor[0] + 1:
+                cursor[1] += 1
+            else:
+                cursor[1] = 0
+                cursor[2] = max(self.minDepth, cursor[2] // 2)
+                cursor[3] = pos
+            cursor[0] = pos
+
+            if cursor[1] < 1:
+                return
+            # Grow the window once the reader has consumed half of it
+            if cursor[3] - pos > cursor[2] // 2 or cursor[3] >= len(names) - 1:
+                return
+            if cursor[3] > pos:
+                cursor[2] = min(self.maxDepth, cursor[2] * 2)
+            start = max(pos, cursor[3]) + 1
+            end = min(len(names), pos + 1 + cursor[2])
+            batch = [n for n in names[start:end] if (db, col, n) not in self.cache]
+            cursor[3] = max(cursor[3], end - 1)
+
+        if batch:
+            self.queue.put((db, col, batch))
+
+    def forget(self, db, col=None):
+        """Drops the listings of db.col, or of all of db."""
+        with self.lock:
+            for ns in [ns for ns in self.listings if _within(ns, db, col)]:
+                del self.listings[ns]
+                del self.cursors[ns]
+
+    def _run(self):
+        while True:
+            db, col, batch = self.queue.get()
+            try:
+                self.fetch(db, col, batch)
+            except Exception:
+                pass
+
+    def fetch(self, db, col, batch):
+        """Loads the named documents that are not already cached with one
+           query."""
+        docIds = []
+        for name in batch:
+            if (db, col, name) in self.cache:
+                continue
+            try:
+                docIds.append(ids.decode(name))
+            except ValueError:
+                pass
+        if not docIds:
+            return
+        for doc in call(self.conn[db][col].find, {'_id' : {'$in' : docIds}}):
+            self.cache.put((db, col, ids.encode(doc['_id'])), doc, prefetched=True)
+            self.issued += 1
+
+    def stats(self):
+        used = self.cache.prefetchHits
+        return {
+            'depth' : max([c[2] for c in self.cursors.values()] or [self.minDepth]),
+            'prefetched' : self.issued,
+            'used' : used,
+            'hit_rate' : float(used) / self.issued if self.issued else 0.0
+            }
+
+def _within(key, db, col):
+    """True if key, a (db, col, ...) tuple, is in db.col, or in db when col
+       is None"""
+    return key[0] == db and (col is None or key[1] == col)
+
+class NegativeCache:
+    """Remembers paths that recently failed with ENOENT so that repeated
+       probes for files like .git or *.swp never reach the server.
+       Entries live for ttl seconds and the table holds at most
+       maxEntries paths, oldest evicted first."""
+
+    def __init__(self, maxEntries=8192, ttl=2.0):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def __contains__(self, path):
+        with self.lock:
+            expires = self.entries.get(path)
+            if expires is None:
+                return False
+            if expires < time.time():
+                del self.entries[path]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, path):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries.pop(path, None)
+            self.entries[path] = time.time() + self.ttl
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
+
+    def stats(self):
+        return {
+            'entries' : len(self.entries),
+            'hits' : self.hits
+            }
@@ -0,0 +1,152 @@
+# Connecting to Mongo
+#
+# A mount can be pointed at a single mongod, a replica set or a set of
+# mongos routers with a standard connection string:
+#
+#   mongodb://db1,db2,db3/?replicaSet=rs0&readPreference=secondaryPreferred
+#       &maxStalenessSeconds=90
+#
+# readPreference routes the reads the mount makes; writes always go to the
+# primary.  pymongo 2 does not know maxStalenessSeconds, so a ReadRouter
+# enforces it by watching replication lag.  Like the server, it refuses a
+# bound below 90 seconds; -1 means no bound.
+#
+# Documents come back as SON, in the order the server stores their fields,
+# so that compound _ids always encode to the same filename (see ids.py).
+
+from urllib import urlencode
+from urlparse import parse_qsl
+
+from tracing import call
+
+import pymongo
+import re
+import threading
+import time
+
+from bson.son import SON
+from pymongo import ReadPreference
+
+STALENESS_OPTION = 'maxstalenessseconds'
+# Smallest bound the server side implementation accepts
+MIN_STALENESS = 90
+# host:port, [v6 address]:port or a comma separated list of those
+WITH_PORT = re.compile(r'^(\[[^\]]*\]|[^:\[\]]*):\d+$')
+
+def _uri(host, port):
+    """Returns a connection string for host, keeping the port it names and
+       adding port otherwise."""
+    if host.startswith('mongodb://'):
+        return host
+    if all(WITH_PORT.match(h) for h in host.split(',')):
+        return 'mongodb://' + host
+    if ':' in host and not host.startswith('['):
+        host = '[%s]' % host        # bare IPv6 address
+    return 'mongodb://%s:%d' % (host, int(port or 27017))
+
+def _split(uri):
+    """Returns the connection string without its options, and the options
+       as a list of (name, value) pairs."""
+    if '?' not in uri:
+        return uri, []
+    base, query = uri.split('?', 1)
+    return base, parse_qsl(query)
+
+def connect(host, port=None, lazy=False):
+    """Returns (conn, router) for host, which is either a bare host name or
+       a mongodb:// connection string.  router is None unless it is needed
+       to keep reads within a staleness bound.  A lazy connection returns at
+       once and connects on first use."""
+    base, options = _split(_uri(host, port))
+    staleness = None
+    replicaSet = False
+    for name, value in options:
+        if name.lower() == STALENESS_OPTION:
+            staleness = int(value)
+            if staleness == -1:
+                staleness = None
+            elif staleness < MIN_STALENESS:
+                raise ValueError('maxStalenessSeconds must be -1 or at '
+                                 'least %d, not %d' %
+                                 (MIN_STALENESS, staleness))
+        elif name.lower() == 'replicaset':
+            replicaSet = True
+
+    options = [(n, v) for n, v in options if n.lower() != STALENESS_OPTION]
+    uri = base + ('?' + urlencode(options) if options else '')
+    if replicaSet:
+        # Only the replica set client of pymongo 2 reads from secondaries
+        conn = pymongo.MongoReplicaSetClient(uri, document_class=SON,
+                                             _connect=not lazy)
+    else:
+        conn = pymongo.MongoClient(uri, document_class=SON,
+                                   _connect=not lazy)
+    router = None
+    if (staleness and replicaSet and
+        conn.read_preference != ReadPreference.PRIMARY):
+        router = ReadRouter(conn, staleness)
+    return conn, router
+
+class ReadRouter:
+    """Falls back to reading from the primary while every secondary lags it
+       by more than maxStaleness seconds, and returns reads to the
+       configured read preference once one catches up."""
+
+    def __init__(self, conn, maxStaleness, interval=5.0):
+        self.conn = conn
+        self.maxStaleness = maxStaleness
+        self.interval = interval
+        self.preference = conn.read_preference
+        self.lag = None
+        self.fallbacks = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def check(self):
+        status = call(self.conn['admin'].command, 'replSetGetStatus')
+        primary = None
+        secondaries = []
+        for member in status.get('members', []):
+            if member.get('state') == 1:
+                primary = member['optimeDate']
+            elif member.get('state') == 2 and member.get('health', 1):
+                secondaries.append(member['optimeDate'])
+        if primary is None or not secondaries:
+            # Nothing to compare against; let the driver decide
+            self.lag = None
+            self._route(self.preference)
+            return
+        self.lag = min(_seconds(primary - s) for s in secondaries)
+        if self.lag > self.maxStaleness:
+            self._route(ReadPreference.PRIMARY_PREFERRED)
+        else:
+            self._route(self.preference)
+
+    def stats(self):
+        return {
+            'lag' : self.lag if self.lag is not None else -1,
+            'on_primary' : int(self.conn.read_preference != self.preference),
+            'fallbacks' : self.fallbacks
+            }
+
+    def _route(self, preference):
+        if self.conn.read_preference != preference:
+            if preference != self.preference:
+                self.fallbacks += 1
+            self.conn.read_preference = preference
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                pass
+            time.sleep(self.interval)
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
@@ -0,0 +1,215 @@
+# Serving several mounts from one process
+#
+# The daemon keeps one SharedState (connection pool, document cache,
+# namespace summaries) and runs each mount's FUSE loop on its own thread.
+# Mounts are added and removed through a line based unix socket:
+#
+#   add <mountpoint> [database]     mount the server, or a single database
+#   remove <mountpoint>             unmount
+#   list                            one "<mountpoint> <database>" per line
+#   stop                            unmount everything and exit
+#
+# Every reply ends with a line reading "ok" or "error <message>".  The same
+# commands can be sent with
+#
+#   python -m humongoufs.daemon <socket> add /mnt/team team
+#
+# libfuse keeps a single process wide session for SIGTERM, SIGINT and
+# SIGHUP, so with several loops a signal would only end the last one
+# mounted.  It only installs its handlers over the default ones, so the
+# daemon installs its own first and unmounts everything when signalled.
+
+from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+class Mount:
+    def __init__(self, mountpoint, database, fs):
+        self.mountpoint = mountpoint
+        self.database = database
+        self.fs = fs
+        self.thread = None
+        self.error = None
+
+# How long add waits for a mount to come up
+MOUNT_TIMEOUT = 30.0
+
+class ControlServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+class Daemon:
+    def __init__(self, shared, socketPath, lowlevel=False, negativeTTL=2.0):
+        self.shared = shared
+        self.socketPath = os.path.abspath(socketPath)
+        self.lowlevel = lowlevel
+        self.negativeTTL = negativeTTL
+        self.mounts = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def add(self, mountpoint, database=None):
+        from humongoufs import Humongoufs, mount
+        mountpoint = os.path.abspath(mountpoint)
+        with self.lock:
+            if mountpoint in self.mounts:
+                raise ValueError('%s is already mounted' % mountpoint)
+            if not os.path.isdir(mountpoint):
+                raise ValueError('%s is not a directory' % mountpoint)
+            fs = Humongoufs(None, None, negativeTTL=self.negativeTTL,
+                            shared=self.shared, database=database)
+            entry = Mount(mountpoint, database, fs)
+            self.mounts[mountpoint] = entry
+        entry.thread = threading.Thread(target=self._serve, args=(entry,))
+        entry.thread.daemon = True
+        entry.thread.start()
+        # Reply once the mount is up, or with the reason it is not
+        deadline = time.time() + MOUNT_TIMEOUT
+        while not fs.mounted.wait(0.1):
+            if not entry.thread.is_alive():
+                raise ValueError('cannot mount %s: %s' %
+                                 (mountpoint, entry.error or 'fuse exited'))
+            if time.time() > deadline:
+                raise ValueError('%s did not come up in %ds' %
+                                 (mountpoint, MOUNT_TIMEOUT))
+
+    def remove(self, mountpoint):
+        mountpoint = os.path.abspath(mountpoint)
+        with self.lock:
+            entry = self.mounts.get(mountpoint)
+        if entry is None:
+            raise ValueError('%s is not mounted' % mountpoint)
+        unmount(mountpoint)
+        entry.thread.join(10)
+        if entry.thread.is_alive():
+            raise ValueError('%s is busy' % mountpoint)
+
+    def list(self):
+        with self.lock:
+            return [(m.mountpoint, m.database or '')
+                    for m in sorted(self.mounts.values(),
+                                    key=lambda m: m.mountpoint)]
+
+    def stop(self):
+        for mountpoint, database in self.list():
+            try:
+                self.remove(mountpoint)
+            except ValueError:
+                pass
+        if self.server:
+            threading.Thread(target=self.server.shutdown).start()
+
+    def serve(self):
+        """Answers the control socket until a stop command or a signal."""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._signalled)
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        daemon = self
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                # readline, as iterating a socket file waits for a full buffer
+                for line in iter(self.rfile.readline, ''):
+                    self.wfile.write(daemon.command(line.split()))
+        # Only the owner may connect, from the moment the socket exists
+        umask = os.umask(0177)
+        try:
+            self.server = ControlServer(self.socketPath, Handler)
+        finally:
+            os.umask(umask)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(self.socketPath)
+            self.shared.close()
+
+    def command(self, words):
+        """Runs one control command and returns its reply."""
+        try:
+            if not words:
+                raise ValueError('empty command')
+            name, args = words[0], words[1:]
+            if name == 'add' and len(args) in (1, 2):
+                self.add(*args)
+                return 'ok\n'
+            if name == 'remove' and len(args) == 1:
+                self.remove(args[0])
+                return 'ok\n'
+            if name == 'list' and not args:
+                return ''.join('%s %s\n' % m for m in self.list()) + 'ok\n'
+            if name == 'stop' and not args:
+                self.stop()
+                return 'ok\n'
+            raise ValueError('unknown command: %s' % ' '.join(words))
+        except Exception, e:
+            return 'error %s\n' % e
+
+    def _signalled(self, signum, frame):
+        # stop waits for the mounts to go away, which the main thread
+        # should not do inside a handler
+        threading.Thread(target=self.stop).start()
+
+    def _serve(self, entry):
+        from humongoufs import mount
+        fsname = 'Humongoufs'
+        if entry.database:
+            fsname += ':' + entry.database
+        try:
+            mount(entry.fs, entry.mountpoint, self.lowlevel, foreground=True,
+                  negativeTTL=self.negativeTTL, fsname=fsname)
+        except Exception, e:
+            entry.error = e
+            if not entry.fs.mounted.is_set():
+                # FUSE never got as far as init, so destroy will not come
+                entry.fs.destroy('/')
+        finally:
+            with self.lock:
+                self.mounts.pop(entry.mountpoint, None)
+
+def unmount(mountpoint):
+    try:
+        subprocess.call(['fusermount', '-u', mountpoint])
+    except OSError:
+        subprocess.call(['umount', mountpoint])
+
+def daemonize():
+    """Detaches from the terminal the way fuse_daemonize does."""
+    if os.fork():
+        os._exit(0)
+    os.setsid()
+    os.chdir('/')
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null, fd)
+
+def send(socketPath, words):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(socketPath)
+    conn.sendall(' '.join(words) + '\n')
+    reply = ''
+    f = conn.makefile()
+    for line in iter(f.readline, ''):
+        reply += line
+        if line == 'ok\n' or line.startswith('error '):
+            break
+    conn.close()
+    return reply
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print 'usage: %s <socket> add <mountpoint> [database] | ' \
+              'remove <mountpoint> | list | stop' % sys.argv[0]
+        sys.exit(1)
+    words = sys.argv[2:]
+    if words[0] in ('add', 'remove') and len(words) > 1:
+        # The daemon runs from /, so relative paths mean nothing to it
+        words[1] = os.path.abspath(words[1])
+    reply = send(sys.argv[1], words)
+    sys.stdout.write(reply)
+    sys.exit(0 if reply.endswith('ok\n') else 1)
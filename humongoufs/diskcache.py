@@ -0,0 +1,230 @@
+# Persistent document cache
+#
+# A second tier under DocumentCache that survives remounts.  Bodies are
+# stored as BSON files named by their SHA-1, so identical documents share a
+# file.  An index stored alongside records,
+# per (db, col, filename), the body, its size and the document's update
+# marker (the _fs_mtime field), in least recently used order.
+#
+# A copy on disk is only served once it is known to be current: either a
+# collection listing (which projects the marker anyway) showed the same
+# marker, or a single projected query did.  Documents without a marker
+# cannot be checked that way and are not stored.  Listings are not stored
+# either: there is no check for one that is cheaper than listing again.
+
+from bson.son import SON
+from collections import OrderedDict
+
+import bson
+import calendar
+import datetime
+import errno
+import hashlib
+import json
+import os
+import threading
+import time
+
+INDEX = 'index.json'
+
+def _marker(value):
+    """The update marker as stored in the index"""
+    if isinstance(value, datetime.datetime):
+        return (calendar.timegm(value.utctimetuple()) * 1000 +
+                value.microsecond // 1000)
+    return value
+
+class DiskCache:
+    def __init__(self, path, field, maxBytes=1 << 30, validFor=10.0,
+                 interval=30.0, tracer=None):
+        self.path = path
+        self.field = field
+        self.maxBytes = maxBytes
+        # No longer than the memory tier keeps a document, or other
+        # clients' changes would stay hidden for longer with a disk cache
+        self.validFor = validFor
+        self.interval = interval
+        self.tracer = tracer
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> [digest, marker, size]
+        self.refs = {}                  # digest -> number of keys using it
+        self.bytes = 0
+        self.validated = {}             # key -> time the marker is trusted to
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.thread = None
+        if not os.path.isdir(os.path.join(path, 'bodies')):
+            os.makedirs(os.path.join(path, 'bodies'))
+        self._load()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """Returns the document for key if its copy was recently confirmed
+           current, or None."""
+        with self.lock:
+            if self.validated.get(key, 0) < time.time():
+                return None
+        return self._read(key)
+
+    def load(self, key, marker):
+        """Returns the document for key if marker, just read from the
+           server, is the one stored with it."""
+        self.validate(key, marker)
+        return self.get(key)
+
+    def put(self, key, doc):
+        marker = _marker(doc.get(self.field))
+        if marker is None:
+            self.invalidate(key)
+            return
+        data = bson.BSON.encode(doc)
+        if len(data) > self.maxBytes:
+            self.invalidate(key)
+            return
+        digest = hashlib.sha1(data).hexdigest()
+        body = self._body(digest)
+        if not os.path.exists(body):
+            if not os.path.isdir(os.path.dirname(body)):
+                os.makedirs(os.path.dirname(body))
+            tmp = '%s.%d.tmp' % (body, threading.current_thread().ident)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, body)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = [digest, marker, len(data)]
+            self.refs[digest] = self.refs.get(digest, 0) + 1
+            self.bytes += len(data)
+            self.validated[key] = time.time() + self.validFor
+            self.dirty = True
+            while self.bytes > self.maxBytes:
+                self._remove(next(iter(self.entries)))
+
+    def validate(self, key, marker):
+        """Trusts the copy of key for a while if marker matches it, and
+           drops it otherwise."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            if entry[1] == _marker(marker):
+                self.validated[key] = time.time() + self.validFor
+            else:
+                self._remove(key)
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def invalidateCollection(self, db, col=None):
+        with self.lock:
+            for key in [k for k in self.entries
+                        if k[0] == db and (col is None or k[1] == col)]:
+                self._remove(key)
+
+    def save(self):
+        """Writes the index out if it changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            entries = [list(key) + entry
+                       for key, entry in self.entries.iteritems()]
+            self.dirty = False
+        tmp = os.path.join(self.path, INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp, os.path.join(self.path, INDEX))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries' : len(self.entries),
+            'bytes' : self.bytes,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : float(self.hits) / lookups if lookups else 0.0
+            }
+
+    '''Helpers'''
+    def _body(self, digest):
+        return os.path.join(self.path, 'bodies', digest[:2], digest)
+
+    def _read(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                # Most recently used entries go last
+                del self.entries[key]
+                self.entries[key] = entry
+                self.dirty = True
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            with open(self._body(entry[0]), 'rb') as f:
+                body = f.read()
+            if len(body) != entry[2]:
+                raise ValueError('truncated body')
+            doc = bson.BSON(body).decode(as_class=SON)
+        except (EnvironmentError, ValueError, bson.errors.BSONError):
+            self.invalidate(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        self.validated.pop(key, None)
+        if entry is None:
+            return
+        self.dirty = True
+        self.bytes -= entry[2]
+        self.refs[entry[0]] -= 1
+        if self.refs[entry[0]] == 0:
+            del self.refs[entry[0]]
+            try:
+                os.unlink(self._body(entry[0]))
+            except OSError:
+                pass
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, INDEX)) as f:
+                entries = json.load(f)
+        except (IOError, ValueError):
+            entries = []
+        for db, col, name, digest, marker, size in entries:
+            if not os.path.exists(self._body(digest)):
+                continue
+            key = tuple(s.encode('utf-8') for s in (db, col, name))
+            self.entries[key] = [digest, marker, size]
+            self.refs[digest] = self.refs.get(digest, 0) + 1
+            self.bytes += size
+        # Bodies written after the index was last saved are not accounted
+        # for; drop them
+        for parent, dirs, files in os.walk(os.path.join(self.path, 'bodies')):
+            for name in files:
+                if name not in self.refs:
+                    os.unlink(os.path.join(parent, name))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except Exception, e:
+                # Keep going; the index is saved again next time
+                if self.tracer and self.tracer.wants(True):
+                    self.tracer.record('disk_cache', self.path, 0, 0,
+                                       getattr(e, 'errno', None) or errno.EIO,
+                                       'saving the index: %s' % e)
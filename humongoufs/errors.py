@@ -0,0 +1,71 @@
+# Driver errors as errno values
+#
+# What a failed Mongo call means to the program that made the system call:
+# try again (EAGAIN, ETIMEDOUT, EIO), fix the data (EFBIG, EINVAL), or give
+# up (EACCES, EROFS) -- rather than EADV for everything.
+
+from bson.errors import InvalidDocument, InvalidStringData
+from fuse import FuseOSError
+
+import errno
+import pymongo.errors as driver
+
+# Server error codes with a more specific meaning than EIO
+CODES = {
+    13 : errno.EACCES,          # Unauthorized
+    10107 : errno.EAGAIN,       # NotMaster
+    13435 : errno.EAGAIN,       # NotMasterNoSlaveOk
+    11600 : errno.EAGAIN,       # InterruptedAtShutdown
+    11602 : errno.EAGAIN,       # InterruptedDueToReplStateChange
+    50 : errno.ETIMEDOUT,       # ExceededTimeLimit
+    121 : errno.EINVAL,         # DocumentValidationFailure
+    10334 : errno.EFBIG,        # BSONObjectTooLarge
+    17419 : errno.EFBIG,        # document grew beyond the maximum size
+    14031 : errno.ENOSPC,       # OutOfDiskSpace
+    20 : errno.EROFS,           # IllegalOperation, e.g. a read only node
+    }
+
+def errnoFor(e):
+    """Returns the errno that best describes driver error e."""
+    if isinstance(e, driver.DuplicateKeyError):
+        return errno.EEXIST
+    if isinstance(e, driver.DocumentTooLarge):
+        return errno.EFBIG
+    if isinstance(e, (InvalidDocument, InvalidStringData, driver.InvalidName)):
+        return errno.EINVAL
+    if isinstance(e, driver.AutoReconnect):
+        return errno.EAGAIN
+    if isinstance(e, (driver.WTimeoutError, driver.ExecutionTimeout)):
+        return errno.ETIMEDOUT
+    if isinstance(e, driver.ConnectionFailure):
+        return errno.EIO
+    if isinstance(e, driver.BulkWriteError):
+        details = e.details or {}
+        for error in details.get('writeErrors', []):
+            return CODES.get(error.get('code'), errno.EIO)
+        if details.get('writeConcernErrors'):
+            return errno.ETIMEDOUT
+    if isinstance(e, driver.OperationFailure):
+        return CODES.get(e.code, errno.EIO)
+    return errno.EIO
+
+def retryable(e):
+    """True if the write that failed with e may succeed when retried:
+       lost connections, elections and write concern timeouts."""
+    if isinstance(e, (driver.ConnectionFailure, driver.WTimeoutError,
+                      driver.ExecutionTimeout)):
+        return True
+    if isinstance(e, driver.BulkWriteError):
+        details = e.details or {}
+        codes = [error.get('code') for error in details.get('writeErrors', [])]
+        if not codes:
+            return bool(details.get('writeConcernErrors'))
+        return all(CODES.get(code) in (errno.EAGAIN, errno.ETIMEDOUT)
+                   for code in codes)
+    if isinstance(e, driver.OperationFailure):
+        return CODES.get(e.code) in (errno.EAGAIN, errno.ETIMEDOUT)
+    return False
+
+def wrap(e):
+    """A FuseOSError for driver error e"""
+    return FuseOSError(errnoFor(e))
@@ -27,16 +27,25 @@ from traceback import print_exc
 _system = system()
 _machine = machine()
 
-if _system == 'Darwin':
-    _libfuse_path = find_library('fuse4x') or find_library('fuse')
-else:
-    _libfuse_path = find_library('fuse')
-if not _libfuse_path:
-    raise EnvironmentError('Unable to find libfuse')
+def _load_libfuse():
+    # find_library runs ldconfig (or gcc) in a subprocess, which is a good
+    # part of startup; the usual soname is tried with a plain dlopen first
+    if _system == 'Linux':
+        try:
+            return CDLL('libfuse.so.2')
+        except OSError:
+            pass
+    if _system == 'Darwin':
+        path = find_library('fuse4x') or find_library('fuse')
+    else:
+        path = find_library('fuse')
+    if not path:
+        raise EnvironmentError('Unable to find libfuse')
+    return CDLL(path)
 
 if _system == 'Darwin':
     _libiconv = CDLL(find_library('iconv'), RTLD_GLOBAL) # libfuse dependency
-_libfuse = CDLL(_libfuse_path)
+_libfuse = _load_libfuse()
 
 if _system == 'Darwin' and hasattr(_libfuse, 'macfuse_version'):
     _system = 'Darwin-MacFuse'
@@ -396,9 +405,11 @@ class FUSE(object):
         ret = self.operations('read', path, size, offset, fh)
         if not ret:
             return 0
-        data = create_string_buffer(ret[:size], size)
-        memmove(buf, data, size)
-        return size
+        # Short reads return what there is; with direct_io the kernel does
+        # not clamp to st_size, so padding would reach the reader
+        ret = ret[:size]
+        memmove(buf, ret, len(ret))
+        return len(ret)
     
     def write(self, path, buf, size, offset, fip):
         data = string_at(buf, size)
@@ -0,0 +1,592 @@
+# ctypes binding for the libfuse low level (inode based) API
+#
+# Companion to fuse.py.  Instead of a path string, every callback receives
+# inode numbers; the filesystem answers lookup() to hand out inodes and is
+# told through forget() when the kernel drops them.  Assumes libfuse 2.8 or
+# later; readdirplus is used when the library provides it (2.9).
+
+from __future__ import division
+
+from ctypes import *
+from errno import *
+from functools import partial
+from os.path import abspath
+from stat import S_IFDIR
+from time import time
+from traceback import print_exc
+
+from fuse import (_libfuse, _system, c_dev_t, c_gid_t, c_mode_t, c_off_t,
+                  c_stat, c_statvfs, c_uid_t, fuse_file_info, set_st_attrs,
+                  time_of_timespec, FuseOSError, ENOTSUP)
+
+fuse_ino_t = c_ulong
+fuse_req_t = c_void_p
+
+# Smallest readdirplus entry: struct fuse_direntplus and an 8 byte name
+DIRENTPLUS_MIN = 160
+
+FUSE_SET_ATTR_MODE = 1 << 0
+FUSE_SET_ATTR_UID = 1 << 1
+FUSE_SET_ATTR_GID = 1 << 2
+FUSE_SET_ATTR_SIZE = 1 << 3
+FUSE_SET_ATTR_ATIME = 1 << 4
+FUSE_SET_ATTR_MTIME = 1 << 5
+FUSE_SET_ATTR_ATIME_NOW = 1 << 7
+FUSE_SET_ATTR_MTIME_NOW = 1 << 8
+
+class fuse_args(Structure):
+    _fields_ = [
+        ('argc', c_int),
+        ('argv', POINTER(c_char_p)),
+        ('allocated', c_int)]
+
+class fuse_entry_param(Structure):
+    _fields_ = [
+        ('ino', fuse_ino_t),
+        ('generation', c_ulong),
+        ('attr', c_stat),
+        ('attr_timeout', c_double),
+        ('entry_timeout', c_double)]
+
+if _system in ('Darwin', 'Darwin-MacFuse'):
+    ll_setxattr_t = CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p,
+        POINTER(c_byte), c_size_t, c_int, c_uint32)
+    ll_getxattr_t = CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p,
+        c_size_t, c_uint32)
+else:
+    ll_setxattr_t = CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p,
+        POINTER(c_byte), c_size_t, c_int)
+    ll_getxattr_t = CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p, c_size_t)
+
+class fuse_lowlevel_ops(Structure):
+    _fields_ = [
+        ('init', CFUNCTYPE(None, c_void_p, c_void_p)),
+        ('destroy', CFUNCTYPE(None, c_void_p)),
+        ('lookup', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p)),
+        ('forget', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_ulong)),
+        ('getattr', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('setattr', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, POINTER(c_stat),
+            c_int, POINTER(fuse_file_info))),
+        ('readlink', CFUNCTYPE(None, fuse_req_t, fuse_ino_t)),
+        ('mknod', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p, c_mode_t,
+            c_dev_t)),
+        ('mkdir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p, c_mode_t)),
+        ('unlink', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p)),
+        ('rmdir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p)),
+        ('symlink', CFUNCTYPE(None, fuse_req_t, c_char_p, fuse_ino_t, c_char_p)),
+        ('rename', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p, fuse_ino_t,
+            c_char_p)),
+        ('link', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, fuse_ino_t, c_char_p)),
+        ('open', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('read', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_size_t, c_off_t,
+            POINTER(fuse_file_info))),
+        ('write', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, POINTER(c_byte),
+            c_size_t, c_off_t, POINTER(fuse_file_info))),
+        ('flush', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('release', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('fsync', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_int,
+            POINTER(fuse_file_info))),
+        ('opendir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('readdir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_size_t, c_off_t,
+            POINTER(fuse_file_info))),
+        ('releasedir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t,
+            POINTER(fuse_file_info))),
+        ('fsyncdir', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_int,
+            POINTER(fuse_file_info))),
+        ('statfs', CFUNCTYPE(None, fuse_req_t, fuse_ino_t)),
+        ('setxattr', ll_setxattr_t),
+        ('getxattr', ll_getxattr_t),
+        ('listxattr', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_size_t)),
+        ('removexattr', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p)),
+        ('access', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_int)),
+        ('create', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_char_p, c_mode_t,
+            POINTER(fuse_file_info))),
+        ('getlk', c_void_p),
+        ('setlk', c_void_p),
+        ('bmap', c_void_p),
+        ('ioctl', c_void_p),
+        ('poll', c_void_p),
+        ('write_buf', c_void_p),
+        ('retrieve_reply', c_void_p),
+        ('forget_multi', c_void_p),
+        ('flock', c_void_p),
+        ('fallocate', c_void_p),
+        ('readdirplus', CFUNCTYPE(None, fuse_req_t, fuse_ino_t, c_size_t,
+            c_off_t, POINTER(fuse_file_info)))]
+
+_libfuse.fuse_mount.argtypes = [c_char_p, POINTER(fuse_args)]
+_libfuse.fuse_mount.restype = c_void_p
+_libfuse.fuse_unmount.argtypes = [c_char_p, c_void_p]
+_libfuse.fuse_lowlevel_new.argtypes = [POINTER(fuse_args),
+    POINTER(fuse_lowlevel_ops), c_size_t, c_void_p]
+_libfuse.fuse_lowlevel_new.restype = c_void_p
+_libfuse.fuse_daemonize.argtypes = [c_int]
+_libfuse.fuse_set_signal_handlers.argtypes = [c_void_p]
+_libfuse.fuse_remove_signal_handlers.argtypes = [c_void_p]
+_libfuse.fuse_session_add_chan.argtypes = [c_void_p, c_void_p]
+_libfuse.fuse_session_remove_chan.argtypes = [c_void_p]
+_libfuse.fuse_session_loop.argtypes = [c_void_p]
+_libfuse.fuse_session_loop_mt.argtypes = [c_void_p]
+_libfuse.fuse_session_destroy.argtypes = [c_void_p]
+_libfuse.fuse_session_exit.argtypes = [c_void_p]
+
+_libfuse.fuse_reply_err.argtypes = [fuse_req_t, c_int]
+_libfuse.fuse_reply_none.argtypes = [fuse_req_t]
+_libfuse.fuse_reply_none.restype = None
+_libfuse.fuse_reply_entry.argtypes = [fuse_req_t, POINTER(fuse_entry_param)]
+_libfuse.fuse_reply_create.argtypes = [fuse_req_t, POINTER(fuse_entry_param),
+    POINTER(fuse_file_info)]
+_libfuse.fuse_reply_attr.argtypes = [fuse_req_t, POINTER(c_stat), c_double]
+_libfuse.fuse_reply_readlink.argtypes = [fuse_req_t, c_char_p]
+_libfuse.fuse_reply_open.argtypes = [fuse_req_t, POINTER(fuse_file_info)]
+_libfuse.fuse_reply_write.argtypes = [fuse_req_t, c_size_t]
+_libfuse.fuse_reply_buf.argtypes = [fuse_req_t, c_char_p, c_size_t]
+_libfuse.fuse_reply_statfs.argtypes = [fuse_req_t, POINTER(c_statvfs)]
+_libfuse.fuse_reply_xattr.argtypes = [fuse_req_t, c_size_t]
+_libfuse.fuse_add_direntry.argtypes = [fuse_req_t, c_void_p, c_size_t,
+    c_char_p, POINTER(c_stat), c_off_t]
+_libfuse.fuse_add_direntry.restype = c_size_t
+
+_has_readdirplus = hasattr(_libfuse, 'fuse_add_direntry_plus')
+if _has_readdirplus:
+    _libfuse.fuse_add_direntry_plus.argtypes = [fuse_req_t, c_void_p,
+        c_size_t, c_char_p, POINTER(fuse_entry_param), c_off_t]
+    _libfuse.fuse_add_direntry_plus.restype = c_size_t
+
+
+def entry_param(entry):
+    """Builds a fuse_entry_param from a dict with the keys ino, attr,
+       attr_timeout, entry_timeout and (optionally) generation."""
+    e = fuse_entry_param()
+    e.ino = entry.get('ino', 0)
+    e.generation = entry.get('generation', 0)
+    set_st_attrs(e.attr, entry.get('attr', {}))
+    e.attr.st_ino = e.ino
+    e.attr_timeout = entry.get('attr_timeout', 1.0)
+    e.entry_timeout = entry.get('entry_timeout', 1.0)
+    return e
+
+
+class FUSELL(object):
+    """Low level counterpart of fuse.FUSE.  operations should be a
+       LowLevelOperations instance; its return values are turned into the
+       matching fuse_reply_* call and FuseOSErrors into fuse_reply_err."""
+
+    def __init__(self, operations, mountpoint, **kwargs):
+        self.operations = operations
+        # fuse_daemonize changes to /, and unmounting comes after it
+        mountpoint = abspath(mountpoint)
+        args = ['fuse']
+        foreground = kwargs.pop('foreground', False)
+        if kwargs.pop('debug', False):
+            args.append('-d')
+        multithreaded = not kwargs.pop('nothreads', False)
+        kwargs.setdefault('fsname', operations.__class__.__name__)
+        args.append('-o')
+        args.append(','.join(key if val == True else '%s=%s' % (key, val)
+            for key, val in kwargs.items()))
+        argv = (c_char_p * len(args))(*args)
+        fargs = fuse_args(len(args), argv, 0)
+
+        ops = fuse_lowlevel_ops()
+        for name, prototype in fuse_lowlevel_ops._fields_:
+            if prototype != c_void_p and getattr(operations, name, None):
+                if name == 'readdirplus' and not _has_readdirplus:
+                    continue
+                op = partial(self._wrapper_, name, getattr(self, name))
+                setattr(ops, name, prototype(op))
+
+        chan = _libfuse.fuse_mount(mountpoint, byref(fargs))
+        if not chan:
+            raise RuntimeError('Unable to mount %s' % mountpoint)
+        session = _libfuse.fuse_lowlevel_new(byref(fargs), byref(ops),
+                                             sizeof(ops), None)
+        if not session:
+            _libfuse.fuse_unmount(mountpoint, chan)
+            raise RuntimeError('Unable to create a FUSE session')
+
+        err = -1
+        try:
+            if _libfuse.fuse_set_signal_handlers(session) == 0:
+                _libfuse.fuse_session_add_chan(session, chan)
+                _libfuse.fuse_daemonize(int(foreground))
+                if multithreaded:
+                    err = _libfuse.fuse_session_loop_mt(session)
+                else:
+                    err = _libfuse.fuse_session_loop(session)
+                _libfuse.fuse_remove_signal_handlers(session)
+                _libfuse.fuse_session_remove_chan(chan)
+        finally:
+            _libfuse.fuse_session_destroy(session)
+            _libfuse.fuse_unmount(mountpoint, chan)
+
+        del self.operations     # Invoke the destructor
+        if err:
+            raise RuntimeError(err)
+
+    def _wrapper_(self, name, func, req, *args):
+        """Decorator for the methods that follow.  Returns what the method
+           returns: the byte count for read and write."""
+        if name in ('init', 'destroy'):
+            try:
+                func(req, *args)
+            except:
+                print_exc()
+            return
+        try:
+            return func(req, *args)
+        except OSError, e:
+            self._reply_err(name, req, e.errno or EFAULT)
+        except:
+            print_exc()
+            self._reply_err(name, req, EFAULT)
+
+    def _reply_err(self, name, req, err):
+        if name == 'forget':
+            _libfuse.fuse_reply_none(req)
+        else:
+            _libfuse.fuse_reply_err(req, err)
+
+    def _fh(self, fip):
+        return fip.contents.fh if fip else None
+
+    def _reply_entry(self, req, entry):
+        e = entry_param(entry)
+        _libfuse.fuse_reply_entry(req, byref(e))
+
+    def _reply_attr(self, req, attrs, timeout):
+        st = c_stat()
+        set_st_attrs(st, attrs)
+        _libfuse.fuse_reply_attr(req, byref(st), timeout)
+
+    def init(self, userdata, conn):
+        self.operations('init')
+
+    def destroy(self, userdata):
+        self.operations('destroy')
+
+    def lookup(self, req, parent, name):
+        self._reply_entry(req, self.operations('lookup', parent, name))
+
+    def forget(self, req, ino, nlookup):
+        self.operations('forget', ino, nlookup)
+        _libfuse.fuse_reply_none(req)
+
+    def getattr(self, req, ino, fip):
+        attrs, timeout = self.operations('getattr', ino, self._fh(fip))
+        self._reply_attr(req, attrs, timeout)
+
+    def setattr(self, req, ino, attr, to_set, fip):
+        st = attr.contents
+        changes = {}
+        if to_set & FUSE_SET_ATTR_MODE:
+            changes['st_mode'] = st.st_mode
+        if to_set & FUSE_SET_ATTR_UID:
+            changes['st_uid'] = st.st_uid
+        if to_set & FUSE_SET_ATTR_GID:
+            changes['st_gid'] = st.st_gid
+        if to_set & FUSE_SET_ATTR_SIZE:
+            changes['st_size'] = st.st_size
+        if to_set & FUSE_SET_ATTR_ATIME:
+            changes['st_atime'] = time_of_timespec(st.st_atimespec)
+        if to_set & FUSE_SET_ATTR_MTIME:
+            changes['st_mtime'] = time_of_timespec(st.st_mtimespec)
+        if to_set & FUSE_SET_ATTR_MTIME_NOW:
+            changes['st_mtime'] = time()
+        attrs, timeout = self.operations('setattr', ino, changes,
+                                         self._fh(fip))
+        self._reply_attr(req, attrs, timeout)
+
+    def readlink(self, req, ino):
+        _libfuse.fuse_reply_readlink(req, self.operations('readlink', ino))
+
+    def mknod(self, req, parent, name, mode, rdev):
+        self._reply_entry(req, self.operations('mknod', parent, name, mode,
+                                               rdev))
+
+    def mkdir(self, req, parent, name, mode):
+        self._reply_entry(req, self.operations('mkdir', parent, name, mode))
+
+    def unlink(self, req, parent, name):
+        self.operations('unlink', parent, name)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def rmdir(self, req, parent, name):
+        self.operations('rmdir', parent, name)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def symlink(self, req, link, parent, name):
+        self._reply_entry(req, self.operations('symlink', link, parent, name))
+
+    def rename(self, req, parent, name, newparent, newname):
+        self.operations('rename', parent, name, newparent, newname)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def link(self, req, ino, newparent, newname):
+        self._reply_entry(req, self.operations('link', ino, newparent,
+                                               newname))
+
+    def open(self, req, ino, fip):
+        fi = fip.contents
+        fi.fh = self.operations('open', ino, fi.flags)
+        if self.operations.directIO(ino):
+            fi.direct_io = 1
+        _libfuse.fuse_reply_open(req, fip)
+
+    def read(self, req, ino, size, offset, fip):
+        data = self.operations('read', ino, size, offset, self._fh(fip))
+        data = data[:size] if data else ''
+        _libfuse.fuse_reply_buf(req, data, len(data))
+        return len(data)
+
+    def write(self, req, ino, buf, size, offset, fip):
+        data = string_at(buf, size)
+        count = self.operations('write', ino, data, offset, self._fh(fip))
+        _libfuse.fuse_reply_write(req, count)
+        return count
+
+    def flush(self, req, ino, fip):
+        self.operations('flush', ino, self._fh(fip))
+        _libfuse.fuse_reply_err(req, 0)
+
+    def release(self, req, ino, fip):
+        self.operations('release', ino, self._fh(fip))
+        _libfuse.fuse_reply_err(req, 0)
+
+    def fsync(self, req, ino, datasync, fip):
+        self.operations('fsync', ino, datasync, self._fh(fip))
+        _libfuse.fuse_reply_err(req, 0)
+
+    def opendir(self, req, ino, fip):
+        fip.contents.fh = self.operations('opendir', ino)
+        _libfuse.fuse_reply_open(req, fip)
+
+    def readdir(self, req, ino, size, offset, fip):
+        entries = self.operations('readdir', ino, self._fh(fip))
+        buf = create_string_buffer(size)
+        pos = 0
+        for i in xrange(offset, len(entries)):
+            name, child = entries[i]
+            st = c_stat()
+            st.st_ino = child.get('ino', 0)
+            st.st_mode = child.get('st_mode', 0)
+            needed = _libfuse.fuse_add_direntry(req, addressof(buf) + pos,
+                                                size - pos, name, byref(st),
+                                                i + 1)
+            if needed > size - pos:
+                break
+            pos += needed
+        _libfuse.fuse_reply_buf(req, buf.raw[:pos], pos)
+
+    def readdirplus(self, req, ino, size, offset, fip):
+        buf = create_string_buffer(size)
+        pos = 0
+        # Entries that could not be looked up are skipped, so the operation
+        # hands back each entry's index in the listing
+        entries = self.operations('readdirplus', ino, offset,
+                                  size // DIRENTPLUS_MIN + 1, self._fh(fip))
+        for n, (i, name, entry) in enumerate(entries):
+            e = entry_param(entry)
+            needed = _libfuse.fuse_add_direntry_plus(req, addressof(buf) + pos,
+                                                     size - pos, name,
+                                                     byref(e), i + 1)
+            if needed > size - pos:
+                # The kernel never saw these entries, so give their
+                # references back
+                for i, name, entry in entries[n:]:
+                    if entry.get('ino') and name not in ('.', '..'):
+                        self.operations('forget', entry['ino'], 1)
+                break
+            pos += needed
+        _libfuse.fuse_reply_buf(req, buf.raw[:pos], pos)
+
+    def releasedir(self, req, ino, fip):
+        self.operations('releasedir', ino, self._fh(fip))
+        _libfuse.fuse_reply_err(req, 0)
+
+    def fsyncdir(self, req, ino, datasync, fip):
+        self.operations('fsyncdir', ino, datasync, self._fh(fip))
+        _libfuse.fuse_reply_err(req, 0)
+
+    def statfs(self, req, ino):
+        stv = c_statvfs()
+        for key, val in self.operations('statfs', ino).items():
+            if hasattr(stv, key):
+                setattr(stv, key, val)
+        _libfuse.fuse_reply_statfs(req, byref(stv))
+
+    def setxattr(self, req, ino, name, value, size, flags, *args):
+        data = string_at(value, size)
+        self.operations('setxattr', ino, name, data, flags, *args)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def getxattr(self, req, ino, name, size, *args):
+        ret = self.operations('getxattr', ino, name, *args)
+        if size == 0:
+            _libfuse.fuse_reply_xattr(req, len(ret))
+        elif len(ret) > size:
+            _libfuse.fuse_reply_err(req, ERANGE)
+        else:
+            _libfuse.fuse_reply_buf(req, ret, len(ret))
+
+    def listxattr(self, req, ino, size):
+        names = self.operations('listxattr', ino)
+        ret = ''.join(name + '\x00' for name in names)
+        if size == 0:
+            _libfuse.fuse_reply_xattr(req, len(ret))
+        elif len(ret) > size:
+            _libfuse.fuse_reply_err(req, ERANGE)
+        else:
+            _libfuse.fuse_reply_buf(req, ret, len(ret))
+
+    def removexattr(self, req, ino, name):
+        self.operations('removexattr', ino, name)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def access(self, req, ino, mask):
+        self.operations('access', ino, mask)
+        _libfuse.fuse_reply_err(req, 0)
+
+    def create(self, req, parent, name, mode, fip):
+        fi = fip.contents
+        entry, fi.fh = self.operations('create', parent, name, mode, fi.flags)
+        e = entry_param(entry)
+        _libfuse.fuse_reply_create(req, byref(e), fip)
+
+
+class LowLevelOperations(object):
+    """This class should be subclassed and passed as an argument to FUSELL.
+       Operations take inode numbers instead of paths and should raise
+       FuseOSError on error.
+
+       Operations that create a directory entry (lookup, mkdir, create, ...)
+       return an entry dict with the keys ino, attr, attr_timeout and
+       entry_timeout.  Each entry handed to the kernel adds one reference to
+       its inode, released later through forget.  An entry with ino 0 is a
+       negative entry and is cached by the kernel for entry_timeout."""
+
+    def __call__(self, op, *args):
+        if not hasattr(self, op):
+            raise FuseOSError(EFAULT)
+        return getattr(self, op)(*args)
+
+    def init(self):
+        """Called on filesystem initialization, after daemonizing."""
+        pass
+
+    def destroy(self):
+        pass
+
+    def lookup(self, parent, name):
+        raise FuseOSError(ENOENT)
+
+    def forget(self, ino, nlookup):
+        pass
+
+    def getattr(self, ino, fh=None):
+        """Returns an (attrs, attr_timeout) tuple."""
+        if ino != 1:
+            raise FuseOSError(ENOENT)
+        return dict(st_ino=1, st_mode=(S_IFDIR | 0755), st_nlink=2), 1.0
+
+    def setattr(self, ino, changes, fh=None):
+        """changes holds the stat fields to update.  Returns an
+           (attrs, attr_timeout) tuple like getattr."""
+        raise FuseOSError(EROFS)
+
+    def readlink(self, ino):
+        raise FuseOSError(ENOENT)
+
+    def mknod(self, parent, name, mode, rdev):
+        raise FuseOSError(EROFS)
+
+    def mkdir(self, parent, name, mode):
+        raise FuseOSError(EROFS)
+
+    def unlink(self, parent, name):
+        raise FuseOSError(EROFS)
+
+    def rmdir(self, parent, name):
+        raise FuseOSError(EROFS)
+
+    def symlink(self, link, parent, name):
+        raise FuseOSError(EROFS)
+
+    def rename(self, parent, name, newparent, newname):
+        raise FuseOSError(EROFS)
+
+    def link(self, ino, newparent, newname):
+        raise FuseOSError(EROFS)
+
+    def open(self, ino, flags):
+        """Returns a numerical file handle."""
+        return 0
+
+    def read(self, ino, size, offset, fh):
+        raise FuseOSError(EIO)
+
+    def write(self, ino, data, offset, fh):
+        raise FuseOSError(EROFS)
+
+    def flush(self, ino, fh):
+        return 0
+
+    def release(self, ino, fh):
+        return 0
+
+    def fsync(self, ino, datasync, fh):
+        return 0
+
+    def opendir(self, ino):
+        """Returns a numerical file handle."""
+        return 0
+
+    def readdir(self, ino, fh):
+        """Returns the complete listing as a list of (name, attrs) tuples,
+           where attrs holds at least ino and st_mode.  The listing must stay
+           the same for the life of fh since the kernel pages through it by
+           index."""
+        return [('.', {'ino' : ino, 'st_mode' : S_IFDIR}),
+                ('..', {'ino' : ino, 'st_mode' : S_IFDIR})]
+
+    # readdirplus(ino, offset, count, fh) returns a list of (index, name,
+    # entry) for up to count entries of the listing from offset on
+    readdirplus = None
+
+    def directIO(self, ino):
+        """True if reads of ino should bypass the page cache, as for files
+           whose contents change between stat and read."""
+        return False
+
+    def releasedir(self, ino, fh):
+        return 0
+
+    def fsyncdir(self, ino, datasync, fh):
+        return 0
+
+    def statfs(self, ino):
+        return {}
+
+    def setxattr(self, ino, name, value, flags, position=0):
+        raise FuseOSError(ENOTSUP)
+
+    def getxattr(self, ino, name, position=0):
+        raise FuseOSError(ENOTSUP)
+
+    def listxattr(self, ino):
+        return []
+
+    def removexattr(self, ino, name):
+        raise FuseOSError(ENOTSUP)
+
+    def access(self, ino, mask):
+        return 0
+
+    def create(self, parent, name, mode, flags):
+        """Returns an (entry, fh) tuple."""
+        raise FuseOSError(EROFS)
@@ -0,0 +1,109 @@
+# Open file handles
+#
+# Writes to an open document are collected in a buffer on its handle and
+# saved with a single round trip when the handle is flushed, so a file
+# written in many chunks (or truncated and rewritten, the way editors save)
+# reaches Mongo as one whole document rather than as a run of appends.
+
+import itertools
+import threading
+
+class OpenFile(object):
+    __slots__ = ('path', 'obj', 'buffer', 'dirty', 'writable', 'unlinked',
+                 'lock')
+
+    def __init__(self, path, obj, buffer=None, writable=True):
+        self.path = path
+        self.obj = obj
+        self.buffer = buffer
+        self.dirty = False
+        self.writable = writable
+        self.unlinked = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        # Handles opened with O_TRUNC or by create start out empty and never
+        # need the current contents
+        if self.buffer is None:
+            self.buffer = self.obj.read()
+
+    def read(self):
+        # Rendered once per handle; every chunk is a slice of the same string
+        with self.lock:
+            self._load()
+            return self.buffer
+
+    def write(self, data, offset):
+        with self.lock:
+            self._load()
+            buf = self.buffer
+            if offset > len(buf):
+                buf += '\0' * (offset - len(buf))
+            self.buffer = buf[:offset] + data + buf[offset + len(data):]
+            self.dirty = True
+        return len(data)
+
+    def truncate(self, length):
+        with self.lock:
+            if length == 0:
+                self.buffer = ''
+            else:
+                self._load()
+                buf = self.buffer[:length]
+                self.buffer = buf + '\0' * (length - len(buf))
+            self.dirty = True
+
+    def reload(self):
+        """Drops the rendered contents of a clean handle, so that the next
+           read sees a change made elsewhere."""
+        with self.lock:
+            if not self.dirty:
+                self.buffer = None
+
+    def size(self):
+        with self.lock:
+            return len(self.buffer) if self.dirty else None
+
+    def flush(self):
+        """Saves the buffer if it holds unsaved writes."""
+        with self.lock:
+            # Writes to a file removed while open go nowhere, as on disk
+            if self.dirty and not self.unlinked:
+                self.obj.write(self.buffer, 0)
+            self.dirty = False
+
+class HandleTable:
+    """Maps the fh numbers handed to the kernel to OpenFiles"""
+
+    def __init__(self):
+        self.handles = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def open(self, path, obj, contents=None, dirty=False, writable=True):
+        """Returns a new fh for obj.  contents, when known, saves fetching
+           the document before the first write."""
+        handle = OpenFile(path, obj, contents, writable)
+        handle.dirty = dirty
+        fh = self.counter.next()
+        with self.lock:
+            self.handles[fh] = handle
+        return fh
+
+    def get(self, fh):
+        return self.handles.get(fh)
+
+    def opened(self, path):
+        """Returns the handles open on path"""
+        with self.lock:
+            return [h for h in self.handles.values() if h.path == path]
+
+    def release(self, fh):
+        with self.lock:
+            return self.handles.pop(fh, None)
+
+    def stats(self):
+        return {
+            'open' : len(self.handles),
+            'dirty' : sum(1 for h in self.handles.values() if h.dirty)
+            }
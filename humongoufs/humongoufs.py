@@ -1,23 +1,61 @@
 #!/usr/bin/env python
 
 import errno
+import os
+import threading
 from collections import defaultdict
 from stat import S_IFDIR, S_IFLNK, S_IFREG
 from sys import argv, exit
 from time import time
 
-from fuse import FUSE, FuseOSError, Operations, LoggingMixIn
-from pymongo import Connection
+from fuse import FUSE, FuseOSError, Operations
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
 
 import mongo_objects
+from cache import NegativeCache
+from handles import HandleTable
+from nodes import PathTable
+from shared import SharedState
+from stats import InstrumentedFUSE, StatsFile, instrumentedLowLevel
+from tracing import Tracer, TraceFile, TracingMixIn
 
-class Humongoufs(LoggingMixIn, Operations):
+class Humongoufs(TracingMixIn, Operations):
     """Example memory filesystem. Supports only one level of files."""
     
-    def __init__(self, host, port):
-        self.conn = Connection(host,port)
+    def __init__(self, host, port, readahead=16, negativeTTL=2.0, tracer=None,
+                 metricsPort=None, conn=None, shared=None, database=None,
+                 cacheBytes=256 << 20, cacheDir=None, diskBytes=1 << 30,
+                 journalDir=None, writeConcern=1, namespace=None):
+        self.ownsShared = shared is None
+        if shared is None:
+            shared = SharedState(host, port, readahead, tracer, metricsPort,
+                                 conn, cacheBytes, cacheDir, diskBytes,
+                                 journalDir, writeConcern, namespace)
+        self.shared = shared
+        self.conn = shared.conn
+        self.tracer = shared.tracer
+        self.metrics = shared.metrics
+        self.cache = shared.cache
+        self.sampler = shared.sampler
+        self.prefetcher = shared.prefetcher
+        self.journal = shared.journal
+        self.virtual = {
+            '/.trace' : TraceFile(self.tracer),
+            '/.stats' : StatsFile(self.metrics)
+            }
+        self.negative = NegativeCache(ttl=negativeTTL)
+        self.nodes = PathTable(root=(database,) if database else ())
+        self.handles = HandleTable()
+        self.mounted = threading.Event()    # set once FUSE calls init
+
+        suffix = ':' + database if database else ''
+        self.metrics.addSource('negative_cache' + suffix, self.negative.stats)
+        self.metrics.addSource('handles' + suffix, self.handles.stats)
+
+    def init(self, path):
+        self.shared.start()
+        self.mounted.set()
 
     def chmod(self, path, mode):
         raise FuseOSError(errno.EPERM)
@@ -29,55 +67,104 @@ class Humongoufs(LoggingMixIn, Operations):
         obj = self.makeNewObjectFromPath(path)
         if isinstance(obj, mongo_objects.Document):
             obj.create()
+            self.negative.invalidate(path)
+            # Freshly created, so there is nothing to save until written
+            return self.handles.open(path, obj, '')
         else:
             raise FuseOSError(errno.EPERM)
 
     def destroy(self, path):
-        self.conn.disconnect()
+        self.metrics.removeSource(self.negative.stats)
+        self.metrics.removeSource(self.handles.stats)
+        if self.ownsShared:
+            self.shared.close()
     
     def getattr(self, path, fh=None):
-        obj = self.getObjectFromPath(path)
-        return obj.getattr()
+        if path in self.negative:
+            raise FuseOSError(errno.ENOENT)
+        node = self.nodes.lookup(path)
+        try:
+            attrs = self.getObjectFromPath(path, node).getattr()
+        except FuseOSError, e:
+            if e.errno == errno.ENOENT:
+                self.negative.add(path)
+                self.nodes.remove(path)
+            raise
+        attrs['st_ino'] = node.ino
+        handle = self.handles.get(fh)
+        if handle is not None and handle.size() is not None:
+            attrs['st_size'] = handle.size()
+        return attrs
 
-#    def getxattr(self, path, name, position=0):
-#        attrs = self.files[path].get('attrs', {})
-#        try:
-#            return attrs[name]
-#        except KeyError:
-#            return ''       # Should return ENOATTR
+    def directIO(self, path):
+        """The virtual files are generated on every read, so their size
+           at stat time says nothing about what a read returns."""
+        return path in self.virtual
+
+    def getxattr(self, path, name, position=0):
+        obj = self.getObjectFromPath(path)
+        if isinstance(obj, mongo_objects.Document):
+            return obj.getxattr(name)
+        raise FuseOSError(mongo_objects.ENOATTR)
     
     def flush(self, path, fh):
-        print 'path:', path, 'fh:', fh
+        handle = self.handles.get(fh)
+        if handle is not None:
+            handle.flush()
+            self.negative.invalidate(path)
         return 0
 
-#    def listxattr(self, path):
-#        attrs = self.files[path].get('attrs', {})
-#        return attrs.keys()
+    def fsync(self, path, datasync, fh):
+        return self.flush(path, fh)
+
+    def listxattr(self, path):
+        obj = self.getObjectFromPath(path)
+        if isinstance(obj, mongo_objects.Document):
+            return obj.listxattr()
+        return []
     
     def mkdir(self, path, mode):
         obj = self.makeNewObjectFromPath(path)
         if isinstance(obj, mongo_objects.Database) or isinstance(obj, mongo_objects.Collection):
+            self.negative.invalidate(path)
             return obj.mkdir()
         else:
             raise FuseOSError(errno.ENOTDIR)
 
-#    def open(self, path, flags):
-#        self.fd += 1
-#        return self.fd
+    def open(self, path, flags):
+        obj = self.getObjectFromPath(path)
+        if isinstance(obj, mongo_objects.Document):
+            if flags & os.O_TRUNC:
+                # Saved on release even if nothing gets written
+                return self.handles.open(path, obj, '', dirty=True)
+            return self.handles.open(path, obj, writable=bool(
+                flags & (os.O_WRONLY | os.O_RDWR)))
+        return 0
     
     def read(self, path, size, offset, fh):
+        handle = self.handles.get(fh)
+        if handle is not None:
+            return handle.read()[offset:offset + size]
         obj = self.getObjectFromPath(path)
-        if isinstance(obj, mongo_objects.Document):
-            return obj.read()
+        if isinstance(obj, mongo_objects.Document) or path in self.virtual:
+            return obj.read()[offset:offset + size]
         else:
             raise FuseOSError(errno.EPERM)
             
     def readdir(self, path, fh):
         obj = self.getObjectFromPath(path)
+        if path == '/':
+            return obj.readdir() + [p[1:] for p in self.virtual]
         return obj.readdir()
             
     def readlink(self, path):
         raise FuseOSError(errno.EPERM)
+
+    def release(self, path, fh):
+        handle = self.handles.release(fh)
+        if handle is not None:
+            handle.flush()
+        return 0
     
 #    def removexattr(self, path, name):
 #        attrs = self.files[path].get('attrs', {})
@@ -97,22 +184,37 @@ class Humongoufs(LoggingMixIn, Operations):
             newObj, mongo_objects.Document):
             raise FuseOSError(errno.EPERM)
         else:
+            existed = newObj.retrieve_doc() is not None
             data = oldObj.read()
             newObj.write(data, 0)
+            if not existed:
+                # The write counts as a rewrite and the unlink as a removal;
+                # the target is a new document
+                self.sampler.documentsChanged(newObj.db, newObj.col, 1)
+            self.negative.invalidate(new)
             oldObj.unlink()
+            self.nodes.rename(old, new)
 
     
     def rmdir(self, path):
         obj = self.makeNewObjectFromPath(path)
         if isinstance(obj, mongo_objects.Database) or isinstance(obj, mongo_objects.Collection):
-            return obj.rmdir()
+            self.nodes.invalidate(path, children=True)
+            obj.rmdir()
+            # Or a collection recreated soon after would show the old
+            # documents
+            col = getattr(obj, 'col', None)
+            self.cache.invalidateCollection(obj.db, col)
+            if self.prefetcher:
+                self.prefetcher.forget(obj.db, col)
+            return 0
         else:
             raise FuseOSError(errno.ENOTDIR)
     
 #    def setxattr(self, path, name, value, options, position=0):
     
     def statfs(self, path):
-        return dict(f_bsize=512, f_blocks=4096, f_bavail=2048)
+        return self.sampler.statfs()
     
 #    def symlink(self, target, source):
 #        self.files[target] = dict(st_mode=(S_IFLNK | 0777), st_nlink=1,
@@ -120,53 +222,108 @@ class Humongoufs(LoggingMixIn, Operations):
 #        self.data[target] = source
     
     def truncate(self, path, length, fh=None):
+        handle = self.handles.get(fh)
+        if handle is not None:
+            # ftruncate only touches the buffer; the save happens on flush
+            handle.truncate(length)
+            return 0
+        handles = self.handles.opened(path)
+        writers = [h for h in handles if h.writable]
+        if writers:
+            # Without atomic_o_trunc the kernel sends the O_TRUNC of an open
+            # as a truncate of the path; the writers save it when flushed
+            for handle in writers:
+                handle.truncate(length)
+            return 0
+        obj = self.getObjectFromPath(path)
+        if not isinstance(obj, mongo_objects.Document):
+            raise FuseOSError(errno.EISDIR)
+        obj.truncate(length)
+        for handle in handles:
+            handle.reload()
         return 0
-#        self.data[path] = self.data[path][:length]
-#        self.files[path]['st_size'] = length
     
     # remove
     def unlink(self, path):
         obj = self.makeNewObjectFromPath(path)
         if isinstance(obj, mongo_objects.Document):
             obj.unlink()
+            for handle in self.handles.opened(path):
+                handle.unlinked = True
+            self.nodes.remove(path)
         else:
             raise FuseOSError(errno.EISDIR)
     
+    def utimens(self, path, times=None):
+        obj = self.getObjectFromPath(path)
+        if isinstance(obj, mongo_objects.Document):
+            obj.touch(times[1] if times else time())
+        return 0
+
     def write(self, path, data, offset, fh):
-        print 'offset:', offset, 'to path:', path
+        handle = self.handles.get(fh)
+        if handle is not None:
+            return handle.write(data, offset)
         obj = self.makeNewObjectFromPath(path)
-        if isinstance(obj, mongo_objects.Document):
+        if isinstance(obj, mongo_objects.Document) or path in self.virtual:
             obj.write(data, offset)
+            self.negative.invalidate(path)
         else:
             raise FuseOSError(errno.EPERM)
         
         return len(data)
 
     '''Helper functions'''
-    def parsePath(self, path):
-        return [s for s in path.split('/') if s]
+    def getObjectFromPath(self, path, node=None):
+        """Returns the validated object for path, reusing the one resolved
+           by an earlier call while it is still fresh."""
+        if path in self.virtual:
+            return self.virtual[path]
+        if node is None:
+            node = self.nodes.lookup(path)
+        obj = node.obj
+        if obj is None or node.expires < time():
+            obj = self.makeObject(node.parts)
+            node.obj = obj
+            node.expires = time() + self.nodes.ttl
+        return obj
 
-    def getObjectFromPath(self, path):
-        pp = self.parsePath(path)
+    def makeObject(self, pp):
         if not pp:
-            return mongo_objects.Mongo(self.conn)
+            return mongo_objects.Mongo(self.conn, meta=self.sampler)
         elif len(pp) == 1:
-            return mongo_objects.Database(self.conn, pp[0])
+            return mongo_objects.Database(self.conn, pp[0], meta=self.sampler)
         elif len(pp) == 2:
-            return mongo_objects.Collection(self.conn, pp[0], pp[1])
+            return mongo_objects.Collection(self.conn, pp[0], pp[1],
+                                            prefetcher=self.prefetcher,
+                                            meta=self.sampler,
+                                            cache=self.cache)
         elif len(pp) == 3:
-            return mongo_objects.Document(self.conn, pp[0], pp[1], pp[2])
+            return mongo_objects.Document(self.conn, pp[0], pp[1], pp[2],
+                                          cache=self.cache,
+                                          prefetcher=self.prefetcher,
+                                          meta=self.sampler,
+                                          journal=self.journal)
         else:
             raise FuseOSError(errno.ENOENT)
         
     def makeNewObjectFromPath(self, path):
-        pp = self.parsePath(path)
-        if len(pp) == 1:
-            return mongo_objects.Database(self.conn, pp[0], False)
+        if path in self.virtual:
+            return self.virtual[path]
+        node = self.nodes.lookup(path)
+        pp = node.parts
+        if isinstance(node.obj, mongo_objects.Document):
+            return node.obj
+        elif len(pp) == 1:
+            return mongo_objects.Database(self.conn, pp[0], False,
+                                          meta=self.sampler)
         elif len(pp) == 2:
-            return mongo_objects.Collection(self.conn, pp[0], pp[1], False)
+            return mongo_objects.Collection(self.conn, pp[0], pp[1], False,
+                                            meta=self.sampler)
         elif len(pp) == 3:
-            return mongo_objects.Document(self.conn, pp[0], pp[1], pp[2], False)
+            return mongo_objects.Document(self.conn, pp[0], pp[1], pp[2], False,
+                                          cache=self.cache, meta=self.sampler,
+                                          journal=self.journal)
         else:
             raise FuseOSError(errno.EPERM)
 
@@ -176,21 +333,147 @@ def findOpt(option, args):
         return args.index(option) + 1
     return -1
 
+def findMountpoint(args):
+    """Returns the one argument that is neither an option nor the value of
+       one, or None."""
+    positional = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in FLAGS:
+            pass
+        elif arg.startswith('-'):
+            skip = True
+        else:
+            positional.append(arg)
+    return positional[0] if len(positional) == 1 else None
+
+def mount(fs, mountpoint, lowlevel=False, foreground=False, negativeTTL=2.0,
+          fsname='Humongoufs'):
+    """Serves fs on mountpoint until it is unmounted."""
+    if lowlevel: # serve through the low level, inode based API
+        from lowlevel import HumongoufsLL
+        FUSELL = instrumentedLowLevel(fs.metrics)
+        FUSELL(HumongoufsLL(fs), mountpoint, foreground=foreground,
+               fsname=fsname)
+    else:
+        InstrumentedFUSE(fs, mountpoint, fs.metrics, foreground=foreground,
+                         negative_timeout=negativeTTL, use_ino=True,
+                         fsname=fsname)
+
+# Options that take no value
+FLAGS = ('-f', '-L')
+
 if __name__ == "__main__":
-    if len(argv) < 2:
-        print 'usage: %s <options> <mountpoint>' % argv[0]
+    mountpoint = findMountpoint(argv[1:])
+    socketPath = None
+    idx = findOpt('-D', argv)
+    if idx > 0: # daemon mode, controlled through this unix socket
+        socketPath = argv[idx]
+        idx = -1
+    if mountpoint is None and socketPath is None:
+        print 'usage: %s <mountpoint> <options>' % argv[0]
+        print '       %s -D <socket> [<mountpoint>] <options>' % argv[0]
         exit(1)
 
     host = 'localhost'
     port = 27017
+    readahead = 16
+    negativeTTL = 2.0
+    tracer = Tracer()
 
     idx = findOpt('-h', argv)
-    if idx > 0: # host specified
+    if idx > 0: # host or mongodb:// connection string specified
         host = argv[idx]
         idx = -1
     idx = findOpt('-p', argv)
     if idx > 0: # port specified
-        port = argv[idx]
+        port = int(argv[idx])
         idx = -1
-    
-    fuse = FUSE(Humongoufs(host, port), argv[1], foreground=True)
+    idx = findOpt('-r', argv)
+    if idx > 0: # readahead depth specified, 0 disables prefetching
+        readahead = int(argv[idx])
+        idx = -1
+    idx = findOpt('-e', argv)
+    if idx > 0: # ENOENT cache lifetime in seconds, 0 disables it
+        negativeTTL = float(argv[idx])
+        idx = -1
+    idx = findOpt('-l', argv)
+    if idx > 0: # trace log file
+        tracer = Tracer(logfile=argv[idx])
+        idx = -1
+    idx = findOpt('-t', argv)
+    if idx > 0: # trace level: off, error, info or debug
+        tracer.configure(argv[idx])
+        idx = -1
+    idx = findOpt('-s', argv)
+    if idx > 0: # fraction of successful operations traced
+        tracer.configure(tracer.level, float(argv[idx]))
+        idx = -1
+    metricsPort = None
+    idx = findOpt('-m', argv)
+    if idx > 0: # serve Prometheus metrics on this local port
+        metricsPort = int(argv[idx])
+        idx = -1
+    database = None
+    idx = findOpt('-d', argv)
+    if idx > 0: # mount a single database rather than the whole server
+        database = argv[idx]
+        idx = -1
+    cacheBytes = 256 << 20
+    idx = findOpt('-M', argv)
+    if idx > 0: # document cache memory budget in MB, shared by all mounts
+        cacheBytes = int(argv[idx]) << 20
+        idx = -1
+    cacheDir = None
+    idx = findOpt('-c', argv)
+    if idx > 0: # keep documents in this directory across remounts
+        cacheDir = os.path.abspath(argv[idx])
+        idx = -1
+    diskBytes = 1 << 30
+    idx = findOpt('-C', argv)
+    if idx > 0: # size cap of the on-disk cache in MB
+        diskBytes = int(argv[idx]) << 20
+        idx = -1
+    journalDir = None
+    idx = findOpt('-j', argv)
+    if idx > 0: # write behind through a journal in this directory
+        journalDir = os.path.abspath(argv[idx])
+        idx = -1
+    writeConcern = 1
+    idx = findOpt('-w', argv)
+    if idx > 0: # write concern the journal is applied with: a number or a mode
+        writeConcern = argv[idx]
+        if writeConcern.isdigit():
+            writeConcern = int(writeConcern)
+        idx = -1
+    namespace = None
+    idx = findOpt('-N', argv)
+    if idx > 0: # answer listings from this namespace file while connecting
+        namespace = os.path.abspath(argv[idx])
+        idx = -1
+
+    if socketPath:
+        from daemon import Daemon, daemonize
+        shared = SharedState(host, port, readahead, tracer, metricsPort,
+                             cacheBytes=cacheBytes, cacheDir=cacheDir,
+                             diskBytes=diskBytes, journalDir=journalDir,
+                             writeConcern=writeConcern, namespace=namespace)
+        daemon = Daemon(shared, socketPath, '-L' in argv, negativeTTL)
+        if mountpoint:
+            mountpoint = os.path.abspath(mountpoint)
+        if '-f' not in argv:
+            daemonize()
+        shared.start()
+        if mountpoint:
+            daemon.add(mountpoint, database)
+        daemon.serve()
+    else:
+        fs = Humongoufs(host, port, readahead, negativeTTL, tracer, metricsPort,
+                        database=database, cacheBytes=cacheBytes,
+                        cacheDir=cacheDir, diskBytes=diskBytes,
+                        journalDir=journalDir, writeConcern=writeConcern,
+                        namespace=namespace)
+        mount(fs, mountpoint, '-L' in argv, foreground='-f' in argv,
+              negativeTTL=negativeTTL)
@@ -0,0 +1,101 @@
+# Filename <-> _id encoding
+#
+# ObjectIds appear as their 24 digit hex string and plain strings appear as
+# themselves.  Every other type carries a tag so that a name always decodes
+# to exactly one _id value:
+#
+#   507f1f77bcf86cd799439011    ObjectId
+#   readme                      string
+#   ~s~507f1f77bcf86cd799439011 string that would otherwise be ambiguous
+#   ~i~42                       int / long
+#   ~u~<uuid>                   UUID
+#   ~b~0.00ff                   BSON binary, as subtype.hex
+#   ~j~{"a":1,"b":2}            anything else, as extended JSON
+#
+# Compound _ids keep their fields in stored order only when read as SON,
+# which is why connection.connect asks the driver for SON documents.
+#
+# '%', '/' and NUL cannot appear in a filename and are percent escaped.
+
+from bson import json_util
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from bson.son import SON
+
+import json
+import re
+import uuid
+
+OBJECTID = re.compile('^[0-9a-f]{24}$')
+TAGGED = re.compile('^~[a-z]~')
+
+def encode(_id):
+    """Returns the filename for a document _id."""
+    if isinstance(_id, ObjectId):
+        return str(_id)
+    if isinstance(_id, (int, long)) and not isinstance(_id, bool):
+        return '~i~%d' % _id
+    if isinstance(_id, uuid.UUID):
+        return '~u~' + str(_id)
+    # Binary is a str on Python 2, so it goes before the string case
+    if isinstance(_id, Binary):
+        return '~b~%d.%s' % (_id.subtype, str(_id).encode('hex'))
+    if isinstance(_id, basestring):
+        if isinstance(_id, unicode):
+            _id = _id.encode('utf-8')
+        name = _quote(_id)
+        if name in ('', '.', '..') or OBJECTID.match(name) or TAGGED.match(name):
+            return '~s~' + name
+        return name
+    return '~j~' + _quote(json_util.dumps(_id, separators=(',', ':')))
+
+def decode(name):
+    """Returns the _id value named by a filename.  Raises ValueError if the
+       name is not a valid encoding."""
+    if OBJECTID.match(name):
+        return ObjectId(name)
+    if TAGGED.match(name):
+        tag, body = name[1], name[3:]
+        if tag == 's':
+            return _unquote(body).decode('utf-8')
+        elif tag == 'i':
+            return int(body)
+        elif tag == 'u':
+            return uuid.UUID(body)
+        elif tag == 'b':
+            subtype, data = body.split('.', 1)
+            try:
+                return Binary(data.decode('hex'), int(subtype))
+            except TypeError as e:
+                raise ValueError('bad binary _id in %r: %s' % (name, e))
+        elif tag == 'j':
+            return json.loads(_unquote(body), object_pairs_hook=_object_pairs)
+        raise ValueError('unknown _id tag in %r' % name)
+    return _unquote(name).decode('utf-8')
+
+def idtype(_id):
+    """Returns a short name for the type of an _id value."""
+    if isinstance(_id, ObjectId):
+        return 'objectid'
+    if isinstance(_id, (int, long)) and not isinstance(_id, bool):
+        return 'int'
+    if isinstance(_id, uuid.UUID):
+        return 'uuid'
+    if isinstance(_id, Binary):
+        return 'binary'
+    if isinstance(_id, basestring):
+        return 'string'
+    if isinstance(_id, dict):
+        return 'compound'
+    return type(_id).__name__
+
+'''Helpers'''
+def _quote(s):
+    return s.replace('%', '%25').replace('/', '%2F').replace('\x00', '%00')
+
+def _unquote(s):
+    return s.replace('%2F', '/').replace('%00', '\x00').replace('%25', '%')
+
+def _object_pairs(pairs):
+    # Compound _ids compare field by field, so key order must survive
+    return json_util.object_hook(SON(pairs))
@@ -0,0 +1,264 @@
+# Write-behind journal
+#
+# In write-behind mode a document save is appended to a local journal,
+# fsynced and acknowledged; a background flusher applies the journal to
+# Mongo in batches.  Writers see local disk latency instead of a network
+# round trip plus the write concern.
+#
+# The journal is a file of BSON records, each
+#
+#   {seq, op: 'save' | 'remove', db, col, key, doc | _id}
+#
+# and a second file holds the sequence number of the last record applied.
+# Records after it are replayed when the journal is opened again, so a
+# crash or lost connection loses nothing that was acknowledged.  Once
+# everything is applied the journal file is truncated.
+#
+# Until a record is applied, reads of its document are answered from the
+# journal (see pending), so writers always see their own writes.
+
+from collections import deque
+
+from tracing import call
+
+from pymongo.errors import BulkWriteError, DocumentTooLarge, OperationFailure
+from bson.son import SON
+
+import bson
+import errors
+import os
+import struct
+import threading
+import time
+
+LOG = 'journal.bson'
+APPLIED = 'journal.applied'
+
+# The server would refuse anything larger, long after the writer was told
+# the write succeeded, so such writes are refused up front
+MAX_RECORD = (16 << 20) + 1024
+
+class Journal:
+    def __init__(self, path, conn, w=1, wtimeout=10000, batch=256,
+                 interval=0.05, tracer=None):
+        self.path = path
+        self.conn = conn
+        self.writeConcern = {'w' : w, 'wtimeout' : wtimeout}
+        self.batch = batch
+        self.interval = interval
+        self.tracer = tracer
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.latest = {}        # key -> (seq, doc or None) of its last record
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.applied = 0
+        self.appended = 0
+        self.flushed = 0
+        self.retries = 0
+        self.failed = 0
+        self.thread = None
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._replay()
+        self.log = open(os.path.join(path, LOG), 'ab')
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def save(self, db, col, key, doc):
+        self._append({'op' : 'save', 'db' : db, 'col' : col, 'key' : key,
+                      'doc' : doc})
+
+    def remove(self, db, col, key, _id):
+        self._append({'op' : 'remove', 'db' : db, 'col' : col, 'key' : key,
+                      '_id' : _id})
+
+    def pending(self, key):
+        """Returns (True, doc) if key has a record that has not been applied
+           yet, doc being None for a removal, or (False, None)."""
+        with self.lock:
+            record = self.latest.get(key)
+        if record is None:
+            return False, None
+        return True, record[1] and SON(record[1])
+
+    def drain(self, timeout=None):
+        """Waits until everything appended so far has been applied."""
+        return self.idle.wait(timeout)
+
+    def close(self, timeout=10.0):
+        self.drain(timeout)
+        self.log.close()
+
+    def stats(self):
+        return {
+            'pending' : len(self.queue),
+            'appended' : self.appended,
+            'flushed' : self.flushed,
+            'retries' : self.retries,
+            'failed' : self.failed
+            }
+
+    '''Helpers'''
+    def _append(self, record):
+        with self.lock:
+            record['seq'] = self.applied + len(self.queue) + 1
+            data = bson.BSON.encode(record)
+            if len(data) > MAX_RECORD:
+                raise DocumentTooLarge('document too large for the journal')
+            self.log.write(data)
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self._queue(record)
+            self.appended += 1
+        self.wakeup.set()
+
+    def _queue(self, record):
+        key = (record['db'], record['col'], record['key'])
+        self.queue.append(record)
+        self.latest[key] = (record['seq'], record.get('doc'))
+        self.idle.clear()
+
+    def _replay(self):
+        try:
+            with open(os.path.join(self.path, APPLIED)) as f:
+                self.applied = int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            self.applied = 0
+        try:
+            with open(os.path.join(self.path, LOG), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return
+        records = []
+        for record in _decode(data):
+            if record['seq'] > self.applied:
+                records.append(record)
+        # Sequence numbers restart from the last applied one
+        for i, record in enumerate(records):
+            record['seq'] = self.applied + i + 1
+            for name in ('db', 'col', 'key'):
+                record[name] = record[name].encode('utf-8')
+            self._queue(record)
+        if not records:
+            return
+        with open(os.path.join(self.path, LOG), 'wb') as f:
+            for record in records:
+                f.write(bson.BSON.encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _run(self):
+        delay = self.interval
+        while True:
+            self.wakeup.wait(1.0)
+            self.wakeup.clear()
+            while self.queue:
+                with self.lock:
+                    batch = list(self.queue)[:self.batch]
+                try:
+                    self._apply(batch)
+                except Exception, e:
+                    if errors.retryable(e):
+                        # Back off and try the same batch again; replacing
+                        # and removing by _id is safe to repeat
+                        self.retries += 1
+                        self._trace('retry', e)
+                        time.sleep(delay)
+                        delay = min(delay * 2, 30.0)
+                        continue
+                    self.failed += len(batch)
+                    self._trace('dropped %d records' % len(batch), e)
+                delay = self.interval
+                self._applied(batch)
+
+    def _apply(self, batch):
+        """Applies batch, raising only for errors worth retrying."""
+        # Only the last record for each document matters, and collections
+        # are independent of each other
+        last = {}
+        for record in batch:
+            last[(record['db'], record['col'], record['key'])] = record
+        byCollection = {}
+        for record in batch:
+            key = (record['db'], record['col'], record['key'])
+            if last[key] is record:
+                byCollection.setdefault((record['db'], record['col']),
+                                        []).append(record)
+        for (db, col), records in byCollection.items():
+            bulk = self.conn[db][col].initialize_unordered_bulk_op()
+            for record in records:
+                if record['op'] == 'save':
+                    doc = record['doc']
+                    bulk.find({'_id' : doc['_id']}).upsert().replace_one(doc)
+                else:
+                    bulk.find({'_id' : record['_id']}).remove_one()
+            try:
+                call(bulk.execute, self.writeConcern)
+            except Exception, e:
+                if errors.retryable(e):
+                    raise
+                # The writers have long been told they succeeded; all that
+                # can be done is to record what was lost and move on
+                self._failed(db, col, records, e)
+
+    def _failed(self, db, col, records, e):
+        writeErrors = None
+        if isinstance(e, BulkWriteError):
+            writeErrors = (e.details or {}).get('writeErrors')
+        if not writeErrors:
+            self.failed += len(records)
+            self._trace('dropped %d records for %s.%s' %
+                        (len(records), db, col), e)
+            return
+        # The rest of an unordered bulk was applied
+        for error in writeErrors:
+            self.failed += 1
+            record = records[error['index']]
+            self._trace('dropped %s %s.%s/%s' % (record['op'], db, col,
+                                                 record['key']),
+                        OperationFailure(error.get('errmsg', ''),
+                                         error.get('code')))
+
+    def _applied(self, batch):
+        seq = batch[-1]['seq']
+        with self.lock:
+            for record in batch:
+                self.queue.popleft()
+                key = (record['db'], record['col'], record['key'])
+                if self.latest.get(key, (None,))[0] == record['seq']:
+                    del self.latest[key]
+            self.applied = seq
+            self.flushed += len(batch)
+            tmp = os.path.join(self.path, APPLIED + '.tmp')
+            with open(tmp, 'w') as f:
+                f.write('%d\n' % seq)
+            os.rename(tmp, os.path.join(self.path, APPLIED))
+            if not self.queue:
+                # Everything is in Mongo; start the journal over
+                self.log.truncate(0)
+                self.log.seek(0)
+                self.idle.set()
+
+    def _trace(self, message, e):
+        if self.tracer and self.tracer.wants(True):
+            self.tracer.record('journal', message, 0, 0, errors.errnoFor(e),
+                               str(e))
+
+def _decode(data):
+    """Yields the records in data, stopping at a torn final record."""
+    offset = 0
+    while offset + 4 <= len(data):
+        size = struct.unpack('<i', data[offset:offset + 4])[0]
+        if size < 5 or offset + size > len(data):
+            break
+        try:
+            yield bson.BSON(data[offset:offset + size]).decode(as_class=SON)
+        except bson.errors.BSONError:
+            break
+        offset += size
@@ -0,0 +1,210 @@
+# Humongoufs on the low level FUSE API
+#
+# Inode numbers handed to the kernel are the ones in the Humongoufs path
+# table, so a callback goes straight from inode to resolved node without
+# walking or parsing a path.  Nodes are pinned while the kernel holds a
+# reference to them and dropped from the table when it forgets them.
+
+from itertools import count
+from stat import S_IFDIR, S_IFREG
+
+import errno
+import threading
+
+from fuse import FuseOSError
+from fuse_lowlevel import LowLevelOperations
+from tracing import TracingMixIn
+
+READDIRPLUS_BATCH = 64
+
+class HumongoufsLL(TracingMixIn, LowLevelOperations):
+    def __init__(self, fs, timeout=1.0):
+        self.fs = fs
+        self.nodes = fs.nodes
+        self.tracer = fs.tracer
+        self.timeout = timeout
+        self.listings = {}
+        self.dirents = {}
+        self.handles = count(1)
+        self.lock = threading.Lock()
+
+    def init(self):
+        self.fs.init('/')
+
+    def destroy(self):
+        self.fs.destroy('/')
+
+    def lookup(self, parent, name):
+        node = self.nodes.child(self._node(parent), name)
+        try:
+            return self._entry(node)
+        except FuseOSError, e:
+            if e.errno == errno.ENOENT and self.fs.negative.ttl > 0:
+                return {'ino' : 0, 'entry_timeout' : self.fs.negative.ttl}
+            raise
+
+    def forget(self, ino, nlookup):
+        self.nodes.forget(ino, nlookup)
+
+    def getattr(self, ino, fh=None):
+        return self.fs.getattr(self._node(ino).path, fh), self.timeout
+
+    def setattr(self, ino, changes, fh=None):
+        path = self._node(ino).path
+        if 'st_mode' in changes:
+            self.fs.chmod(path, changes['st_mode'])
+        if 'st_uid' in changes or 'st_gid' in changes:
+            self.fs.chown(path, changes.get('st_uid', -1),
+                          changes.get('st_gid', -1))
+        if 'st_size' in changes:
+            self.fs.truncate(path, changes['st_size'], fh)
+        if 'st_mtime' in changes:
+            self.fs.utimens(path, (changes.get('st_atime', changes['st_mtime']),
+                                   changes['st_mtime']))
+        return self.fs.getattr(path, fh), self.timeout
+
+    def mkdir(self, parent, name, mode):
+        node = self.nodes.child(self._node(parent), name)
+        self.fs.mkdir(node.path, mode)
+        return self._entry(node)
+
+    def unlink(self, parent, name):
+        self.fs.unlink(self._path(parent, name))
+
+    def rmdir(self, parent, name):
+        self.fs.rmdir(self._path(parent, name))
+
+    def rename(self, parent, name, newparent, newname):
+        self.fs.rename(self._path(parent, name), self._path(newparent, newname))
+
+    def open(self, ino, flags):
+        return self.fs.open(self._node(ino).path, flags)
+
+    def directIO(self, ino):
+        return self.fs.directIO(self._node(ino).path)
+
+    def read(self, ino, size, offset, fh):
+        return self.fs.read(self._node(ino).path, size, offset, fh)
+
+    def write(self, ino, data, offset, fh):
+        return self.fs.write(self._node(ino).path, data, offset, fh)
+
+    def flush(self, ino, fh):
+        return self.fs.flush(self._node(ino).path, fh)
+
+    def release(self, ino, fh):
+        return self.fs.release(self._node(ino).path, fh)
+
+    def fsync(self, ino, datasync, fh):
+        return self.fs.fsync(self._node(ino).path, datasync, fh)
+
+    def getxattr(self, ino, name, position=0):
+        return self.fs.getxattr(self._node(ino).path, name, position)
+
+    def listxattr(self, ino):
+        return self.fs.listxattr(self._node(ino).path)
+
+    def opendir(self, ino):
+        self._node(ino)
+        return self.handles.next()
+
+    def readdir(self, ino, fh):
+        # The kernel asks again for every page, so the entries are built
+        # once per open directory handle
+        with self.lock:
+            entries = self.dirents.get(fh)
+        if entries is not None:
+            return entries
+        node = self._node(ino)
+        entries = []
+        for name in self._listing(node, fh):
+            if name in ('.', '..'):
+                entries.append((name, {'ino' : node.ino, 'st_mode' : S_IFDIR}))
+            else:
+                child = self.nodes.child(node, name)
+                entries.append((name, {'ino' : child.ino,
+                                       'st_mode' : self._kind(child)}))
+        with self.lock:
+            self.dirents[fh] = entries
+        return entries
+
+    def readdirplus(self, ino, offset, count, fh):
+        node = self._node(ino)
+        names = self._listing(node, fh)
+        attrs = None
+        prefetcher = self.fs.prefetcher
+        entries = []
+        for i in xrange(offset, len(names)):
+            if len(entries) >= count:
+                break
+            name = names[i]
+            if name in ('.', '..'):
+                if attrs is None:
+                    attrs = self.fs.getattr(node.path)
+                entries.append((i, name, {'ino' : 0, 'attr' : attrs,
+                                          'attr_timeout' : self.timeout,
+                                          'entry_timeout' : self.timeout}))
+                continue
+            if (len(node.parts) == 2 and prefetcher and
+                (i - offset) % READDIRPLUS_BATCH == 0):
+                # Documents need their body for st_size, so pull the next
+                # batch into the document cache with a single query
+                prefetcher.fetch(node.parts[0], node.parts[1],
+                                 names[i:i + READDIRPLUS_BATCH])
+            try:
+                entries.append((i, name,
+                                self._entry(self.nodes.child(node, name))))
+            except FuseOSError:
+                continue
+        return entries
+
+    def releasedir(self, ino, fh):
+        with self.lock:
+            self.listings.pop(fh, None)
+            self.dirents.pop(fh, None)
+        return 0
+
+    def statfs(self, ino):
+        return self.fs.statfs('/')
+
+    def create(self, parent, name, mode, flags):
+        node = self.nodes.child(self._node(parent), name)
+        fh = self.fs.create(node.path, mode)
+        return self._entry(node), fh
+
+    '''Helper functions'''
+    def _node(self, ino):
+        node = self.nodes.get(ino)
+        if node is None:
+            raise FuseOSError(errno.ESTALE)
+        return node
+
+    def _path(self, parent, name):
+        return self.nodes.child(self._node(parent), name).path
+
+    def _entry(self, node):
+        attrs = self.fs.getattr(node.path)
+        with self.nodes.lock:
+            node.nlookup += 1
+        return {
+            'ino' : node.ino,
+            'attr' : attrs,
+            'attr_timeout' : self.timeout,
+            'entry_timeout' : self.timeout
+            }
+
+    def _listing(self, node, fh):
+        # The kernel pages through a listing by index, so it is read once
+        # per open directory handle
+        with self.lock:
+            names = self.listings.get(fh)
+        if names is None:
+            names = self.fs.readdir(node.path, fh)
+            with self.lock:
+                self.listings[fh] = names
+        return names
+
+    def _kind(self, node):
+        if len(node.parts) < 3 and node.path not in self.fs.virtual:
+            return S_IFDIR
+        return S_IFREG
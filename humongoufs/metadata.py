@@ -0,0 +1,317 @@
+# Background sampling of server side metadata
+#
+# Anything that needs a server command to answer (dbStats for statfs,
+# collection counts and sizes for directory stats) is refreshed on a timer
+# by a background thread, and callbacks only ever read the latest snapshot.
+# A sweep costs one dbStats and one collection listing per database;
+# collStats is only run for the collections looked at since the last one.
+# Changes made through this mount are applied to the snapshot as they
+# happen, so it does not have to wait for the next sweep to be accurate.
+#
+# The database and collection names can also be kept in a namespace file,
+#
+#   {"sales": ["orders", "customers"], "logs": []}
+#
+# written by hand or left behind by an earlier mount.  Until the first sweep
+# has finished, listings of the root and of databases are answered from it,
+# so a mount is usable before it has even connected.
+
+import json
+import os
+import threading
+import time
+
+from tracing import call
+
+BLOCK_SIZE = 4096
+# Reported when the server does not tell us how big its filesystem is
+UNKNOWN_FREE = 1 << 40
+# Mongo has no inode limit; this is how many more documents statfs says fit
+FREE_INODES = 1 << 32
+
+class Summary(object):
+    __slots__ = ('count', 'size', 'mtime')
+
+    def __init__(self, count=0, size=0, mtime=0):
+        self.count = count
+        self.size = size
+        self.mtime = mtime
+
+class MetadataSampler:
+    """Keeps, per database, the number of collections and the storage size
+       and, per collection, the estimated document count and storage size."""
+
+    def __init__(self, conn, interval=30.0, namespace=None):
+        self.conn = conn
+        self.interval = interval
+        self.namespace = namespace
+        self.totals = None
+        self.sampled = 0
+        self.due = True
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.root = Summary(mtime=time.time())
+        self.databases = {}
+        self.collections = {}
+        # Collections looked at since they were last counted, those counted
+        # at least once, and what this mount created or dropped during the
+        # current sweep (key -> whether it exists)
+        self.wanted = set()
+        self.counted = set()
+        self.changes = {}
+        self.declared = None
+        if namespace:
+            self._loadNamespace()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def refresh(self):
+        """Asks the sampler to take a new sample soon."""
+        self.due = True
+        self.wakeup.set()
+
+    def sample(self):
+        with self.lock:
+            self.changes = {}
+        used = objects = 0
+        fsUsed = fsTotal = None
+        databases = {}
+        collections = {}
+        for db in call(self.conn.database_names):
+            stats = call(self.conn[db].command, 'dbStats')
+            used += stats.get('storageSize', 0) + stats.get('indexSize', 0)
+            objects += stats.get('objects', 0)
+            if 'fsTotalSize' in stats:
+                fsUsed = stats['fsUsedSize']
+                fsTotal = stats['fsTotalSize']
+            names = call(self.conn[db].collection_names)
+            databases[db] = Summary(size=stats.get('storageSize', 0))
+            for col in names:
+                collections[(db, col)] = Summary()
+        if fsTotal:
+            free = max(0, fsTotal - fsUsed)
+        else:
+            free = UNKNOWN_FREE
+        now = time.time()
+        with self.lock:
+            # Counts are only known from collStats, so keep the last ones
+            for key, summary in collections.iteritems():
+                old = self.collections.get(key)
+                if old is not None:
+                    summary.count, summary.size = old.count, old.size
+            self._merge(self.collections, collections, now)
+            for db, col in self.collections:
+                if db in databases:
+                    databases[db].count += 1
+            self._merge(self.databases, databases, now)
+            if len(self.databases) != self.root.count:
+                self.root.mtime = now
+            self.root.count = len(self.databases)
+            self.root.size = used
+        self.totals = (used, free, objects)
+        self.sampled = now
+        self.sampleCollections()
+        if self.namespace:
+            self._saveNamespace()
+
+    def sampleCollections(self):
+        """Counts the collections looked at since they were last counted."""
+        with self.lock:
+            wanted, self.wanted = self.wanted, set()
+        for db, col in wanted:
+            try:
+                stats = call(self.conn[db].command, 'collStats', col)
+            except Exception:
+                continue
+            count = stats.get('count', 0)
+            size = stats.get('storageSize', 0)
+            with self.lock:
+                self.counted.add((db, col))
+                summary = self.collections.get((db, col))
+                if summary is None or (summary.count, summary.size) == (count,
+                                                                        size):
+                    continue
+                summary.count = count
+                summary.size = size
+                summary.mtime = time.time()
+
+    '''Summaries'''
+    def database(self, db):
+        """Returns the Summary for db, or None if it has not been seen."""
+        return self.databases.get(db)
+
+    def collection(self, db, col):
+        with self.lock:
+            summary = self.collections.get((db, col))
+            if summary is not None and (db, col) not in self.wanted:
+                self.wanted.add((db, col))
+                if (db, col) not in self.counted:
+                    # Never counted yet, so do not wait for the next sweep
+                    self.wakeup.set()
+            return summary
+
+    def provisional(self):
+        """True while listings should come from the namespace file, that
+           is until the first sweep has finished."""
+        return self.declared is not None and not self.sampled
+
+    def databaseNames(self):
+        with self.lock:
+            return sorted(self.databases)
+
+    def collectionNames(self, db):
+        with self.lock:
+            return sorted(col for d, col in self.collections if d == db)
+
+    '''Write path events'''
+    def databaseCreated(self, db):
+        with self.lock:
+            self.changes[db] = True
+            if db not in self.databases:
+                self.databases[db] = Summary(mtime=time.time())
+                self.root.count += 1
+                self.root.mtime = time.time()
+
+    def databaseDropped(self, db):
+        with self.lock:
+            self.changes[db] = False
+            if self.databases.pop(db, None) is not None:
+                self.root.count -= 1
+                self.root.mtime = time.time()
+            for key in [k for k in self.collections if k[0] == db]:
+                del self.collections[key]
+                self.changes[key] = False
+        self.refresh()
+
+    def collectionCreated(self, db, col):
+        self.databaseCreated(db)
+        with self.lock:
+            self.changes[(db, col)] = True
+            if (db, col) not in self.collections:
+                self.collections[(db, col)] = Summary(mtime=time.time())
+                summary = self.databases[db]
+                summary.count += 1
+                summary.mtime = time.time()
+
+    def collectionDropped(self, db, col):
+        with self.lock:
+            self.changes[(db, col)] = False
+            if self.collections.pop((db, col), None) is not None:
+                summary = self.databases.get(db)
+                if summary is not None:
+                    summary.count -= 1
+                    summary.mtime = time.time()
+        self.refresh()
+
+    def documentsChanged(self, db, col, delta=0):
+        """Records documents added (delta > 0), removed (delta < 0) or
+           rewritten (delta == 0) in db.col."""
+        with self.lock:
+            summary = self.collections.get((db, col))
+            if summary is None:
+                return
+            summary.count = max(0, summary.count + delta)
+            summary.mtime = time.time()
+
+    def _merge(self, current, sampled, now):
+        # Keep the modification times of entries whose numbers did not move
+        for key, summary in sampled.iteritems():
+            old = current.get(key)
+            if old is None or (old.count, old.size) != (summary.count,
+                                                        summary.size):
+                summary.mtime = now
+            else:
+                summary.mtime = old.mtime
+        # Whatever this mount created or dropped while the sweep ran is
+        # newer than what the sweep saw
+        for key, exists in self.changes.iteritems():
+            if not exists:
+                sampled.pop(key, None)
+            elif key in current:
+                sampled.setdefault(key, current[key])
+        current.clear()
+        current.update(sampled)
+
+    def statfs(self):
+        used, free, objects = self.totals or (0, UNKNOWN_FREE, 0)
+        return dict(
+            f_bsize=BLOCK_SIZE,
+            f_frsize=BLOCK_SIZE,
+            f_blocks=(used + free) // BLOCK_SIZE,
+            f_bfree=free // BLOCK_SIZE,
+            f_bavail=free // BLOCK_SIZE,
+            f_files=objects + FREE_INODES,
+            f_ffree=FREE_INODES,
+            f_favail=FREE_INODES)
+
+    def stats(self):
+        return {
+            'age' : time.time() - self.sampled if self.sampled else -1,
+            'databases' : len(self.databases),
+            'collections' : len(self.collections),
+            'provisional' : int(self.provisional())
+            }
+
+    '''Namespace file'''
+    def _loadNamespace(self):
+        try:
+            with open(self.namespace) as f:
+                declared = json.load(f)
+        except (IOError, ValueError):
+            return
+        # A malformed file is ignored as a whole, as if it were not there
+        if not isinstance(declared, dict):
+            return
+        for names in declared.itervalues():
+            if not (isinstance(names, list) and
+                    all(isinstance(col, basestring) for col in names)):
+                return
+        now = time.time()
+        self.declared = {}
+        for db, names in declared.iteritems():
+            db = db.encode('utf-8')
+            names = [col.encode('utf-8') for col in names]
+            self.declared[db] = sorted(names)
+            self.databases[db] = Summary(len(names), mtime=now)
+            for col in names:
+                self.collections[(db, col)] = Summary(mtime=now)
+        self.root.count = len(self.databases)
+
+    def _saveNamespace(self):
+        # Only rewritten when a database or collection came or went
+        with self.lock:
+            names = dict((db, []) for db in self.databases)
+            for db, col in self.collections:
+                names.setdefault(db, []).append(col)
+        for cols in names.itervalues():
+            cols.sort()
+        if names == self.declared:
+            return
+        tmp = self.namespace + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(names, f, indent=1, sort_keys=True)
+            os.rename(tmp, self.namespace)
+        except EnvironmentError:
+            return
+        self.declared = names
+
+    def _run(self):
+        last = 0
+        while True:
+            try:
+                if self.due or time.time() - last >= self.interval:
+                    self.due = False
+                    last = time.time()
+                    self.sample()
+                else:
+                    self.sampleCollections()
+            except Exception:
+                pass
+            self.wakeup.wait(max(0, last + self.interval - time.time()))
+            self.wakeup.clear()
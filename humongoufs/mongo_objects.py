@@ -3,18 +3,65 @@
 from fuse import FUSE, FuseOSError
 from pymongo import Connection
 from stat import S_IFDIR, S_IFREG
+from bson import json_util
 from bson.objectid import ObjectId
+from bson.son import SON
 
+from tracing import call
+
+import calendar
+import datetime
+import errors
 import time
 import bson
+import pymongo
 import errno
+import ids
 import json
 import sys
 import re
 
+# Maintained on every write so documents keep a stable modification time.
+# It is hidden from the JSON a document reads as.
+MTIME_FIELD = '_fs_mtime'
+
+# Extended attributes of documents.  user.mongo.field.<name> holds the JSON
+# of a single (possibly dotted) field.
+XATTR_BSONSIZE = 'user.mongo.bsonsize'
+XATTR_IDTYPE = 'user.mongo.idtype'
+XATTR_FIELD = 'user.mongo.field.'
+ENOATTR = getattr(errno, 'ENOATTR', getattr(errno, 'ENODATA', None))
+
+# Fields of a document that holds no more than a file's raw contents
+RAW_FIELDS = set(['_id', MTIME_FIELD, 'data'])
+
+def _dirattr(summary, subdirs):
+    """Directory attributes from a metadata Summary.  Directories whose
+       summary has not been sampled yet report no size and the current
+       time."""
+    now = time.time()
+    if summary is None:
+        return {
+            'st_mode' : (S_IFDIR | 0777),
+            'st_nlink' : 2,
+            'st_size' : 0,
+            'st_ctime' : now,
+            'st_mtime' : now,
+            'st_atime' : now
+            }
+    return {
+        'st_mode' : (S_IFDIR | 0777),
+        'st_nlink' : 2 + (summary.count if subdirs else 0),
+        'st_size' : summary.size,
+        'st_ctime' : summary.mtime,
+        'st_mtime' : summary.mtime,
+        'st_atime' : now
+        }
+
 class Mongo:
-    def __init__(self, conn, validate=True):
+    def __init__(self, conn, validate=True, meta=None):
         self.conn = conn
+        self.meta = meta
         if validate and  not self._isValid():
             raise FuseOSError(errno.ENOENT)
 
@@ -22,178 +69,389 @@ class Mongo:
         return not self.conn is None
 
     def getattr(self):
-        mc_time = time.mktime(self.conn['admin'].command('serverStatus')
-                              ['backgroundFlushing']['last_finished'].timetuple())
-        st_size = sum([self.conn[db].command('dbstats')['fileSize'] for db in 
-                       [str(dbName) for dbName in self.conn.database_names()]])
-        return dict(
-            st_mode= (S_IFDIR | 0777),
-            st_nlink=len(self.conn.database_names()),
-            st_size=0,#st_size,
-            st_ctime=mc_time,
-            st_mtime=mc_time,
-            st_atime=time.time())
-            
+        return _dirattr(self.meta and self.meta.root, True)
 
     def readdir(self):
-        return ['.', '..'] + [str(r) for r in self.conn.database_names()]
+        if self.meta and self.meta.provisional():
+            # Not sampled yet, perhaps not even connected
+            return ['.', '..'] + self.meta.databaseNames()
+        return ['.', '..'] + [str(r) for r in call(self.conn.database_names)]
 
 class Database:
-    def __init__(self, conn, db, validate=True):
+    def __init__(self, conn, db, validate=True, meta=None):
         self.conn = conn
         self.db = db
+        self.meta = meta
         if validate and not self._isValid():
             raise FuseOSError(errno.ENOENT)
 
     def _isValid(self):
-        return self.db in self.conn.database_names()
+        if self.meta and self.meta.database(self.db) is not None:
+            return True
+        if self.db in call(self.conn.database_names):
+            if self.meta:
+                self.meta.databaseCreated(self.db)
+            return True
+        return False
     
     def getattr(self):
-        mc_time = time.mktime(self.conn['admin'].command('serverStatus')
-                              ['backgroundFlushing']['last_finished'].timetuple())
-        st_size = self.conn[self.db].command('dbstats')['fileSize'] 
-
-        return {
-            'st_mode' : (S_IFDIR | 0777),
-            'st_nlink' : len(self.conn.database_names()),
-            'st_size' : st_size,
-            'st_ctime' : mc_time,
-            'st_mtime' : mc_time,
-            'st_atime' : time.time()
-            }
+        return _dirattr(self.meta and self.meta.database(self.db), True)
 
     def mkdir(self):
-        self.conn[self.db].create_collection('tmp')
-        self.conn[self.db].drop_collection('tmp')
+        call(self.conn[self.db].create_collection, 'tmp')
+        call(self.conn[self.db].drop_collection, 'tmp')
+        if self.meta:
+            self.meta.databaseCreated(self.db)
 
     def readdir(self):
-        return ['.', '..'] + [str(r) for r in self.conn[self.db].collection_names()]
+        if (self.meta and self.meta.provisional() and
+            self.meta.database(self.db) is not None):
+            return ['.', '..'] + self.meta.collectionNames(self.db)
+        return ['.', '..'] + [str(r) for r in call(self.conn[self.db].collection_names)]
     
     def rmdir(self):
-        self.conn.drop_database(self.db)
+        call(self.conn.drop_database, self.db)
+        if self.meta:
+            self.meta.databaseDropped(self.db)
 
 class Collection:
-    def __init__(self, conn, db, col, validate=True):
+    def __init__(self, conn, db, col, validate=True, prefetcher=None,
+                 meta=None, cache=None):
         self.conn = conn
         self.db = db
         self.col = col
+        self.prefetcher = prefetcher
+        self.meta = meta
+        self.cache = cache
         if validate and not self._isValid():
             raise FuseOSError(errno.ENOENT)
         
     def _isValid(self):
-        return self.col in self.conn[self.db].collection_names()
+        if self.meta and self.meta.collection(self.db, self.col) is not None:
+            return True
+        if self.col in call(self.conn[self.db].collection_names):
+            if self.meta:
+                self.meta.collectionCreated(self.db, self.col)
+            return True
+        return False
 
     def getattr(self):
-        mc_time = time.mktime(self.conn['admin'].command('serverStatus')
-                              ['backgroundFlushing']['last_finished'].timetuple())
-        st_size = self.conn[self.db].command('collStats', self.col)['storageSize']
-        return {
-            'st_mode' : (S_IFDIR | 0777),
-            'st_nlink' : 1,
-            'st_size' : st_size,
-            'st_ctime' : 0,
-            'st_mtime' : 0,
-            'st_atime' : time.time()
-            }
+        # Documents are files, so a collection only has . and ..
+        return _dirattr(self.meta and self.meta.collection(self.db, self.col),
+                        False)
     
     def mkdir(self):
-        self.conn[self.db].create_collection(self.col)
+        call(self.conn[self.db].create_collection, self.col)
+        if self.meta:
+            self.meta.collectionCreated(self.db, self.col)
 
     def readdir(self):
-        return ['.', '..'] + [str(r['_id']) for r in (self.conn[self.db])[self.col].find()]
+        names = []
+        for r in call(self.conn[self.db][self.col].find,
+                      fields=['_id', MTIME_FIELD]):
+            name = ids.encode(r['_id'])
+            names.append(name)
+            if self.cache:
+                # Drop cached copies that were changed by another client
+                self.cache.validate((self.db, self.col, name), MTIME_FIELD,
+                                    r.get(MTIME_FIELD))
+        if self.prefetcher:
+            self.prefetcher.listed(self.db, self.col, names)
+        return ['.', '..'] + names
     
     def rmdir(self):
-        self.conn[self.db].drop_collection(self.col)
+        call(self.conn[self.db].drop_collection, self.col)
+        if self.meta:
+            self.meta.collectionDropped(self.db, self.col)
 
 class Document:
-    def __init__(self, conn, db, col, doc, validate=False):
+    def __init__(self, conn, db, col, doc, validate=False, cache=None,
+                 prefetcher=None, meta=None, journal=None):
         self.conn = conn
         self.db = db
         self.col = col
         self.doc = doc
-        if validate and not self.validated:
+        try:
+            self.docId = ids.decode(doc)
+        except ValueError:
+            raise FuseOSError(errno.ENOENT)
+        self.cache = cache
+        self.prefetcher = prefetcher
+        self.meta = meta
+        self.journal = journal
+        if validate and not self._isValid():
             raise FuseOSError(errno.ENOENT)
 
     def _isValid(self):
         try:
-            return not ((self.conn[self.db])[self.col].find_one(
-                    {'_id' : self.doc}) is None)
+            return not (call((self.conn[self.db])[self.col].find_one,
+                    {'_id' : self.docId}) is None)
         except bson.errors.InvalidId, e:
             raise FuseOSError(errno.ENOENT)
 
     def create(self):
         document = {
-            '_id' : self.doc
+            '_id' : self.docId,
+            MTIME_FIELD : _now()
             }
+        if self.journal:
+            queued, pending = self.journal.pending(self._key())
+            if queued:
+                # Queued behind the pending records, or the flusher would
+                # apply a queued removal after it
+                if pending is not None:
+                    raise FuseOSError(errno.EEXIST)
+                self._save(document, changed=False)
+                self._changed(1)
+                return
+        # Otherwise synchronous even with a journal, so that O_EXCL can see
+        # EEXIST
         try:
-            self.conn[self.db][self.col].insert(document, safe=True)
-        except pymongo.errors.DuplicateKeyError:
-            raise FuseOSError(errno.EEXIST)
+            call(self.conn[self.db][self.col].insert, document, safe=True)
+        except pymongo.errors.PyMongoError, e:
+            raise errors.wrap(e)
+        self._cached(document)
+        self._changed(1)
 
     def getattr(self):
         obj = self.retrieve_doc()
-        if obj:
-            obj['_id'] = self.doc
-            st_size = len(json.dumps(obj, indent=4))
-        else:
-            st_size = 0
-        
-        now = time.time()
+        if obj is None:
+            raise FuseOSError(errno.ENOENT)
+        st_size = len(self._render(obj))
+
+        # ctime is when the _id was generated, mtime the last write through
+        # a mount.  Either falls back to the other, and documents with
+        # neither report the epoch rather than a time that keeps moving.
+        mtime = _timestamp(obj.get(MTIME_FIELD))
+        ctime = None
+        if isinstance(self.docId, ObjectId):
+            ctime = _timestamp(self.docId.generation_time)
+        if mtime is None:
+            mtime = ctime or 0
+        if ctime is None:
+            ctime = mtime
         return {
             'st_mode' : (S_IFREG | 0777),
             'st_nlink' : 1,
             'st_size' : st_size,
-            'st_ctime' : now,
-            'st_mtime' : now,
-            'st_atime' : now
+            'st_ctime' : ctime,
+            'st_mtime' : mtime,
+            'st_atime' : time.time()
             }
 
-    def read(self):
+    def getxattr(self, name):
+        if name == XATTR_IDTYPE:
+            return ids.idtype(self.docId)
+        if name == XATTR_BSONSIZE:
+            # Needs the whole document, which then also serves later reads
+            obj = self.retrieve_doc()
+            if obj is None:
+                raise FuseOSError(errno.ENOENT)
+            return str(len(bson.BSON.encode(obj)))
+        if name.startswith(XATTR_FIELD) and len(name) > len(XATTR_FIELD):
+            field = name[len(XATTR_FIELD):].decode('utf-8')
+            obj = None
+            if self.journal:
+                # Writes not yet applied are newer than the server's copy
+                queued, obj = self.journal.pending(self._key())
+                if queued and obj is None:
+                    raise FuseOSError(errno.ENOENT)
+            if obj is None and self.cache:
+                obj = self.cache.get(self._key())
+            if obj is None:
+                obj = call(self.conn[self.db][self.col].find_one,
+                           {'_id' : self.docId}, fields=[field])
+                if obj is None:
+                    raise FuseOSError(errno.ENOENT)
+            value = obj
+            for part in field.split('.'):
+                if not isinstance(value, dict) or part not in value:
+                    raise FuseOSError(ENOATTR)
+                value = value[part]
+            return json_util.dumps(value)
+        raise FuseOSError(ENOATTR)
+
+    def listxattr(self):
         obj = self.retrieve_doc()
-        if obj:
-            obj['_id'] = self.doc
-        return json.dumps(obj, indent=4)
+        if obj is None:
+            raise FuseOSError(errno.ENOENT)
+        return [XATTR_BSONSIZE, XATTR_IDTYPE] + [
+            (XATTR_FIELD + field).encode('utf-8') for field in obj
+            if field != MTIME_FIELD]
+
+    def read(self):
+        return self._render(self.retrieve_doc())
 
     def readdir(self):
         raise FuseOSError(errno.ENOTDIR)
     
     def unlink(self):
+        self._cached(None)
         try:
-            self.conn[self.db][self.col].remove(ObjectId(self.doc)) 
-        except:
-            self.conn[self.db][self.col].remove({'_id':self.doc})
+            if self.journal and self.journal.pending(self._key())[0]:
+                # Queue the removal behind the pending saves, or the flusher
+                # would bring the document back
+                self.journal.remove(self.db, self.col, self.doc, self.docId)
+            else:
+                call(self.conn[self.db][self.col].remove,
+                     {'_id' : self.docId})
+        except pymongo.errors.PyMongoError, e:
+            raise errors.wrap(e)
+        self._changed(-1)
+
+    def truncate(self, length):
+        if length > 0:
+            # Cutting the rendered JSON would lose the fields, so only the
+            # raw contents of a file written as data can be cut
+            document = self.retrieve_doc()
+            if document is None:
+                raise FuseOSError(errno.ENOENT)
+            data = document.get('data', '')
+            if not isinstance(data, basestring) or set(document) - RAW_FIELDS:
+                if length == len(self._render(document)):
+                    return
+                raise FuseOSError(errno.EINVAL)
+            document['data'] = data[:length] + '\0' * (length - len(data))
+            document[MTIME_FIELD] = _now()
+            self._save(document)
+            return
+        # Truncating to nothing keeps only the _id, which reads as an empty
+        # file, and needs no fetch
+        document = {
+            '_id' : self.docId,
+            MTIME_FIELD : _now()
+            }
+        self._save(document)
+
+    def touch(self, mtime):
+        """Sets the modification time, as touch and rsync -t do"""
+        stamp = _now(mtime)
+        if self.journal:
+            queued, document = self.journal.pending(self._key())
+            if queued:
+                # An update now could be overwritten by the queued save
+                if document is None:
+                    raise FuseOSError(errno.ENOENT)
+                document[MTIME_FIELD] = stamp
+                self._save(document, changed=False)
+                return
+        try:
+            call(self.conn[self.db][self.col].update, {'_id' : self.docId},
+                 {'$set' : {MTIME_FIELD : stamp}}, safe=True)
+        except pymongo.errors.PyMongoError, e:
+            raise errors.wrap(e)
+        document = self.cache and self.cache.get(self._key())
+        if document is not None:
+            document[MTIME_FIELD] = stamp
+            self._cached(document)
 
     def write(self, data, offset):
         try:
             document = json.loads(data)
-            document['_id'] = self.doc
+            document['_id'] = self.docId
+            document[MTIME_FIELD] = _now()
         except:
             if offset > 0: # append
                 document = self.retrieve_doc()
-                document['data'] += data
+                document['data'] = document.get('data', '') + data
+                document[MTIME_FIELD] = _now()
             else:
                 document = {
-                    '_id' : self.doc,
-                    'data' : data
+                    '_id' : self.docId,
+                    MTIME_FIELD : _now()
                     }
-        
-        try:
-            self.conn[self.db][self.col].save(document)
-            return len(json.dumps(document))
-        except:
-            raise FuseOSError(errno.EADV)
+                if data:
+                    document['data'] = data
+        self._save(document)
+        return len(data)
 
     '''Document class helpers'''
     def retrieve_doc(self):
-        collection = self.conn[self.db][self.col]
+        key = self._key()
+        if self.journal:
+            # Writes not yet applied are newer than anything on the server
+            queued, obj = self.journal.pending(key)
+            if queued:
+                return obj
+        if self.prefetcher:
+            self.prefetcher.accessed(self.db, self.col, self.doc)
+        if self.cache:
+            obj = self.cache.get(key)
+            if obj is not None:
+                return obj
+            if self.cache.disk and key in self.cache.disk:
+                # A copy from an earlier mount; fetching only its update
+                # marker is enough to tell whether it can still be used
+                probe = call(self.conn[self.db][self.col].find_one,
+                             {'_id' : self.docId}, fields=[MTIME_FIELD])
+                if probe is None:
+                    self.cache.invalidate(key)
+                    return None
+                obj = self.cache.disk.load(key, probe.get(MTIME_FIELD))
+                if obj is not None:
+                    self.cache.put(key, obj, disk=False)
+                    return obj
+
+        obj = call(self.conn[self.db][self.col].find_one, {'_id' : self.docId})
+        if obj is not None and self.cache:
+            self.cache.put(key, obj)
+        return obj
+
+    def _key(self):
+        return (self.db, self.col, self.doc)
+
+    def _save(self, document, changed=True):
+        """Saves the whole document, through the journal if there is one"""
         try:
-            return collection.find_one(ObjectId(self.doc)) 
-        except:
-            return collection.find_one({
-                    '_id' : self.doc
-                    })
+            if self.journal:
+                self.journal.save(self.db, self.col, self.doc, document)
+            else:
+                call(self.conn[self.db][self.col].save, document)
+        except (pymongo.errors.PyMongoError, bson.errors.BSONError), e:
+            raise errors.wrap(e)
+        self._cached(document)
+        if changed:
+            self._changed(0)
+
+    def _cached(self, document):
+        if not self.cache:
+            return
+        key = self._key()
+        if document is None:
+            self.cache.invalidate(key)
+        else:
+            self.cache.put(key, document)
+
+    def _render(self, obj):
+        if obj is not None and not set(obj) - set(['_id', MTIME_FIELD]):
+            return ''       # created or truncated, and not written since
+        if obj:
+            # A copy that keeps the stored field order
+            obj = SON(obj)
+            obj['_id'] = self.doc
+            obj.pop(MTIME_FIELD, None)
+        return json.dumps(obj, indent=4)
+
+    def _changed(self, delta):
+        if self.meta:
+            self.meta.documentsChanged(self.db, self.col, delta)
 
 '''General helper functions'''
+def _now(seconds=None):
+    # BSON dates only keep milliseconds; truncate so the cached copy of a
+    # document matches what the server hands back
+    if seconds is None:
+        now = datetime.datetime.utcnow()
+    else:
+        now = datetime.datetime.utcfromtimestamp(seconds)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def _timestamp(value):
+    """Seconds since the epoch for a BSON date, or None"""
+    if not isinstance(value, datetime.datetime):
+        return None
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
 def get_id(d_id):
     if isinstance(d_id, str) or isinstance(d_id, unicode):
         return ObjectId(d_id)
@@ -0,0 +1,157 @@
+# Resolved path table
+#
+# Every path the kernel asks about is parsed once into a Node, which keeps
+# the split path components, a stable inode number and the mongo_objects
+# instance that serves it.  Later callbacks on the same path are a single
+# dict lookup.
+#
+# Inode numbers are derived from the full namespace path (database,
+# collection, filename), so a path gets the same st_ino however often its
+# node is evicted or looked up again, and in every mount of the server.
+
+import hashlib
+import struct
+import threading
+
+ROOT_INO = 1
+
+class Node(object):
+    __slots__ = ('path', 'parts', 'ino', 'obj', 'expires', 'nlookup')
+
+    def __init__(self, path, parts, ino):
+        self.path = path
+        self.parts = parts
+        self.ino = ino
+        self.obj = None
+        self.expires = 0
+        self.nlookup = 0
+
+class PathTable:
+    """Maps paths and inode numbers to Nodes.  Resolved objects are reused
+       for ttl seconds before they are validated again.  Once the table
+       holds more than maxNodes entries, the oldest quarter of the nodes
+       the kernel does not hold a reference to are dropped.
+
+       root is the path components the mount's root stands for, () for the
+       whole server or (db,) for a mount scoped to a single database."""
+
+    def __init__(self, ttl=5.0, maxNodes=65536, root=()):
+        self.ttl = ttl
+        self.maxNodes = maxNodes
+        self.paths = {}
+        self.inodes = {}
+        self.lock = threading.Lock()
+        self.root = tuple(root)
+        node = Node('/', self.root, ROOT_INO)
+        self.paths['/'] = node
+        self.inodes[ROOT_INO] = node
+
+    def lookup(self, path):
+        node = self.paths.get(path)
+        if node is None:
+            node = self._add(path, self.root +
+                             tuple(s for s in path.split('/') if s))
+        return node
+
+    def child(self, parent, name):
+        """Returns the node for name inside the directory parent."""
+        if parent.ino == ROOT_INO:
+            path = '/' + name
+        else:
+            path = parent.path + '/' + name
+        node = self.paths.get(path)
+        if node is None:
+            node = self._add(path, parent.parts + (name,))
+        return node
+
+    def get(self, ino):
+        return self.inodes.get(ino)
+
+    def invalidate(self, path, children=False):
+        """Forgets the resolved object for path, and for everything below it
+           if children is set."""
+        with self.lock:
+            node = self.paths.get(path)
+            if node is not None:
+                node.obj = None
+            if children:
+                prefix = path.rstrip('/') + '/'
+                for p, node in self.paths.items():
+                    if p.startswith(prefix):
+                        node.obj = None
+
+    def remove(self, path):
+        """Forgets path, as on unlink.  A node the kernel still holds stays
+           reachable by its inode until it is forgotten."""
+        with self.lock:
+            node = self.paths.get(path)
+            if node is None or node.ino == ROOT_INO:
+                return
+            del self.paths[path]
+            node.obj = None
+            if node.nlookup == 0:
+                self.inodes.pop(node.ino, None)
+
+    def rename(self, old, new):
+        """Moves the node of old to new.  The kernel keeps using the inode
+           it looked up, so a node it holds keeps its number."""
+        self.remove(new)
+        with self.lock:
+            node = self.paths.get(old)
+            if node is None or node.ino == ROOT_INO:
+                return
+            del self.paths[old]
+            node.obj = None
+            if node.nlookup == 0:
+                # Nobody holds the old number; new gets its own next time
+                self.inodes.pop(node.ino, None)
+                return
+            node.path = new
+            node.parts = self.root + tuple(s for s in new.split('/') if s)
+            self.paths[new] = node
+
+    def forget(self, ino, nlookup):
+        """Releases kernel references to an inode, dropping it once none
+           are left."""
+        with self.lock:
+            node = self.inodes.get(ino)
+            if node is None or node.ino == ROOT_INO:
+                return
+            node.nlookup = max(0, node.nlookup - nlookup)
+            if node.nlookup == 0:
+                self._drop(node)
+
+    def __len__(self):
+        return len(self.paths)
+
+    '''Helpers'''
+    def _add(self, path, parts):
+        with self.lock:
+            node = self.paths.get(path)
+            if node is None:
+                if len(self.paths) >= self.maxNodes:
+                    self._evict()
+                node = Node(path, parts, self._ino(parts))
+                self.paths[path] = node
+                self.inodes[node.ino] = node
+            return node
+
+    def _ino(self, parts):
+        ino = struct.unpack('<Q', hashlib.md5('/'.join(parts)).digest()[:8])[0]
+        ino >>= 1           # kept positive for the signed st_ino of Python
+        # An inode still held for another path (a hash collision, or a file
+        # that was unlinked while the kernel held on to it) moves this one on
+        while ino <= ROOT_INO or ino in self.inodes:
+            ino = (ino + 1) & ((1 << 63) - 1)
+        return ino
+
+    def _evict(self):
+        idle = sorted(n.ino for n in self.paths.itervalues()
+                      if n.nlookup == 0 and n.ino != ROOT_INO)
+        for ino in idle[:max(1, len(self.paths) // 4)]:
+            self._drop(self.inodes[ino])
+
+    def _drop(self, node):
+        if self.paths.get(node.path) is node:
+            del self.paths[node.path]
+        self.inodes.pop(node.ino, None)
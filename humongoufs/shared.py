@@ -0,0 +1,90 @@
+# State shared between mounts
+#
+# Everything that is about the server rather than about one mountpoint:
+# the connection pool, the document cache, the namespace summaries, the
+# prefetcher, the write-behind journal, tracing and metrics.  A single mount owns one of these; the
+# daemon hands the same one to every mount it serves, so adding a mount
+# costs a path table and little else.
+
+from cache import DocumentCache, Prefetcher
+from connection import connect
+from diskcache import DiskCache
+from journal import Journal
+from metadata import MetadataSampler
+from mongo_objects import MTIME_FIELD
+from stats import Metrics
+from tracing import Tracer
+
+import threading
+
+class SharedState:
+    def __init__(self, host, port, readahead=16, tracer=None, metricsPort=None,
+                 conn=None, cacheBytes=256 << 20, cacheDir=None,
+                 diskBytes=1 << 30, journalDir=None, writeConcern=1,
+                 namespace=None):
+        # host may also be a mongodb:// connection string.  With a namespace
+        # file the mount can answer before it has connected, so connecting
+        # is left to the first sweep of the sampler
+        self.router = None
+        if conn is None:
+            conn, self.router = connect(host, port, lazy=bool(namespace))
+        self.conn = conn
+        self.tracer = tracer or Tracer()
+        self.metrics = Metrics()
+        self.metricsPort = metricsPort
+        self.disk = None
+        if cacheDir:
+            self.disk = DiskCache(cacheDir, MTIME_FIELD, diskBytes,
+                                  tracer=self.tracer)
+        self.cache = DocumentCache(maxBytes=cacheBytes, disk=self.disk)
+        self.sampler = MetadataSampler(self.conn, namespace=namespace)
+        self.prefetcher = None
+        if readahead > 0:
+            self.prefetcher = Prefetcher(self.conn, self.cache, readahead)
+        self.journal = None
+        if journalDir:
+            # Replays whatever an earlier run left unapplied
+            self.journal = Journal(journalDir, self.conn, writeConcern,
+                                   tracer=self.tracer)
+        self.started = False
+        self.lock = threading.Lock()
+
+        self.metrics.install()
+        self.metrics.addSource('document_cache', self.cache.stats)
+        if self.disk:
+            self.metrics.addSource('disk_cache', self.disk.stats)
+        self.metrics.addSource('metadata', self.sampler.stats)
+        if self.router:
+            self.metrics.addSource('reads', self.router.stats)
+        if self.prefetcher:
+            self.metrics.addSource('prefetch', self.prefetcher.stats)
+        if self.journal:
+            self.metrics.addSource('journal', self.journal.stats)
+
+    def start(self):
+        """Starts the background threads, once.  Called from FUSE init so
+           that they are started after the process has daemonized."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.tracer.start()
+        self.sampler.start()
+        if self.disk:
+            self.disk.start()
+        if self.router:
+            self.router.start()
+        if self.prefetcher:
+            self.prefetcher.start()
+        if self.journal:
+            self.journal.start()
+        if self.metricsPort:
+            self.metrics.serve(self.metricsPort)
+
+    def close(self):
+        if self.journal:
+            # Whatever is not applied by now is replayed on the next start
+            self.journal.close()
+        if self.disk:
+            self.disk.save()
+        self.conn.disconnect()
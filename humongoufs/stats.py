@@ -0,0 +1,239 @@
+# Latency histograms and counters
+#
+# FUSE dispatch is timed by wrapping FUSE._wrapper_ (or FUSELL._wrapper_),
+# Mongo driver calls by the hook in tracing.call.  The numbers can be read
+# from the /.stats file in the mount, or scraped in Prometheus text format
+# from a local HTTP port.
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from errno import EACCES, ENOTDIR
+from stat import S_IFREG
+
+import threading
+import time
+
+from fuse import FUSE, FuseOSError
+from pymongo.collection import Collection
+from pymongo.database import Database
+import tracing
+
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                  0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUNDTRIP_BOUNDS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return float('inf')
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.roundtrips = {}
+        self.driver = {}
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.sources = []
+        self.started = time.time()
+
+    def install(self):
+        """Starts receiving driver call timings from tracing.call."""
+        tracing.observer = self.driverCall
+
+    def addSource(self, name, func):
+        """Registers a function returning a dict of gauges (cache hit rates
+           and the like) to be reported along with the histograms."""
+        self.sources.append((name, func))
+
+    def removeSource(self, func):
+        self.sources = [(n, f) for n, f in self.sources if f != func]
+
+    def fuseOp(self, op, latency, trips):
+        hist = self.ops.get(op)
+        if hist is None:
+            with self.lock:
+                hist = self.ops.setdefault(op, Histogram())
+                self.roundtrips.setdefault(op, Histogram(ROUNDTRIP_BOUNDS))
+        hist.observe(latency)
+        self.roundtrips[op].observe(trips)
+
+    def transferred(self, op, count):
+        if op == 'read':
+            self.bytesOut += count
+        elif op == 'write':
+            self.bytesIn += count
+
+    def driverCall(self, fn, latency):
+        target = getattr(fn, '__self__', None)
+        if isinstance(target, Collection):
+            ns = target.full_name
+        elif isinstance(target, Database):
+            ns = target.name
+        else:
+            ns = ''
+        key = (fn.__name__, ns)
+        hist = self.driver.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.driver.setdefault(key, Histogram())
+        hist.observe(latency)
+
+    def report(self):
+        """Human readable summary, served as /.stats"""
+        lines = ['uptime %.0fs  bytes in %d  bytes out %d' % (
+                time.time() - self.started, self.bytesIn, self.bytesOut), '',
+                 '%-14s %9s %10s %10s %10s %8s' % (
+                'fuse op', 'count', 'mean', 'p50', 'p99', 'rt/op')]
+        for op, hist in sorted(self.ops.items()):
+            trips = self.roundtrips[op]
+            lines.append('%-14s %9d %8.3fms %8.3fms %8.3fms %8.2f' % (
+                    op, hist.total, 1000 * hist.sum / max(1, hist.total),
+                    1000 * hist.quantile(0.5), 1000 * hist.quantile(0.99),
+                    trips.sum / max(1, trips.total)))
+        lines += ['', '%-18s %-24s %9s %10s %10s %10s' % (
+                'driver call', 'namespace', 'count', 'mean', 'p50', 'p99')]
+        for (call, ns), hist in sorted(self.driver.items()):
+            lines.append('%-18s %-24s %9d %8.3fms %8.3fms %8.3fms' % (
+                    call, ns, hist.total, 1000 * hist.sum / max(1, hist.total),
+                    1000 * hist.quantile(0.5), 1000 * hist.quantile(0.99)))
+        for name, func in self.sources:
+            lines += ['', name] + ['  %-12s %s' % item
+                                   for item in sorted(func().items())]
+        return '\n'.join(lines) + '\n'
+
+    def prometheus(self):
+        """Prometheus text exposition format"""
+        out = []
+        def histogram(name, label, hists, bounds):
+            out.append('# TYPE %s histogram' % name)
+            for key, hist in sorted(hists.items()):
+                labels = label(key)
+                seen = 0
+                for bound, n in zip(list(bounds) + ['+Inf'], hist.counts):
+                    seen += n
+                    out.append('%s_bucket{%s,le="%s"} %d' % (name, labels,
+                                                             bound, seen))
+                out.append('%s_sum{%s} %r' % (name, labels, hist.sum))
+                out.append('%s_count{%s} %d' % (name, labels, hist.total))
+        histogram('humongoufs_fuse_op_seconds', lambda op: 'op="%s"' % op,
+                  self.ops, LATENCY_BOUNDS)
+        histogram('humongoufs_fuse_op_roundtrips', lambda op: 'op="%s"' % op,
+                  self.roundtrips, ROUNDTRIP_BOUNDS)
+        histogram('humongoufs_driver_call_seconds',
+                  lambda key: 'call="%s",ns="%s"' % key,
+                  self.driver, LATENCY_BOUNDS)
+        out.append('# TYPE humongoufs_fuse_bytes_total counter')
+        out.append('humongoufs_fuse_bytes_total{direction="in"} %d' % self.bytesIn)
+        out.append('humongoufs_fuse_bytes_total{direction="out"} %d' % self.bytesOut)
+        for name, func in self.sources:
+            for key, value in sorted(func().items()):
+                if isinstance(value, (int, long, float)):
+                    out.append('humongoufs_%s_%s %r' % (name, key, value))
+        return '\n'.join(out) + '\n'
+
+    def serve(self, port):
+        """Serves prometheus() on 127.0.0.1:port from a daemon thread."""
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        server = HTTPServer(('127.0.0.1', port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+class InstrumentedFUSE(FUSE):
+    """FUSE that times every callback, including ctypes marshalling."""
+
+    def __init__(self, operations, mountpoint, metrics, **kwargs):
+        self.metrics = metrics
+        FUSE.__init__(self, operations, mountpoint, **kwargs)
+
+    def _wrapper_(self, func, *args, **kwargs):
+        tracing.reset()
+        start = time.time()
+        ret = FUSE._wrapper_(self, func, *args, **kwargs)
+        self.metrics.fuseOp(func.__name__, time.time() - start,
+                            tracing.roundtrips())
+        if ret > 0:
+            # read and write return the bytes actually moved
+            self.metrics.transferred(func.__name__, ret)
+        return ret
+
+    def open(self, path, fip):
+        ret = FUSE.open(self, path, fip)
+        if self.operations.directIO(path):
+            fip.contents.direct_io = 1
+        return ret
+
+def instrumentedLowLevel(metrics):
+    """Returns a FUSELL subclass timing every callback.  Built on demand so
+       that the low level binding is only loaded when it is used."""
+    from fuse_lowlevel import FUSELL
+
+    class InstrumentedFUSELL(FUSELL):
+        def _wrapper_(self, name, func, req, *args):
+            tracing.reset()
+            start = time.time()
+            ret = FUSELL._wrapper_(self, name, func, req, *args)
+            metrics.fuseOp(name, time.time() - start, tracing.roundtrips())
+            if name in ('read', 'write') and ret > 0:
+                # The size of the reply, not of the request
+                metrics.transferred(name, ret)
+
+    return InstrumentedFUSELL
+
+class StatsFile:
+    """The read-only /.stats file"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def getattr(self):
+        now = time.time()
+        return {
+            'st_mode' : (S_IFREG | 0444),
+            'st_nlink' : 1,
+            'st_size' : len(self.read()),
+            'st_ctime' : now,
+            'st_mtime' : now,
+            'st_atime' : now
+            }
+
+    def read(self):
+        return self.metrics.report()
+
+    def write(self, data, offset):
+        raise FuseOSError(EACCES)
+
+    def readdir(self):
+        raise FuseOSError(ENOTDIR)
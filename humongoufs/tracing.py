@@ -0,0 +1,172 @@
+# Low overhead operation tracing
+#
+# Replaces fuse.LoggingMixIn, which prints every call and the repr of every
+# result.  Records go to an in-memory ring buffer and, if a log file is
+# given, are written out by a background thread so that callbacks never
+# block on I/O.  The level and sample rate can be changed while mounted by
+# writing to the /.trace control file, e.g.
+#
+#   echo 'info 0.1' > /mnt/mongo/.trace
+#   cat /mnt/mongo/.trace
+
+from collections import deque
+from errno import EFAULT, EINVAL, ENOTDIR
+from stat import S_IFREG
+from Queue import Queue
+
+import random
+import threading
+import time
+
+from fuse import FuseOSError
+
+OFF, ERROR, INFO, DEBUG = range(4)
+LEVELS = ['off', 'error', 'info', 'debug']
+
+_local = threading.local()
+
+# Called with (fn, latency) after every driver call, see stats.Metrics
+observer = None
+
+def call(fn, *args, **kwargs):
+    """Performs a single driver call on behalf of the current operation and
+       counts it as one round trip."""
+    _local.roundtrips = getattr(_local, 'roundtrips', 0) + 1
+    if observer is None:
+        return fn(*args, **kwargs)
+    start = time.time()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        observer(fn, time.time() - start)
+
+def reset():
+    _local.roundtrips = 0
+
+def roundtrips():
+    return getattr(_local, 'roundtrips', 0)
+
+class Tracer:
+    def __init__(self, level=OFF, sample=1.0, logfile=None, size=4096):
+        self.level = level
+        self.sample = sample
+        self.logfile = logfile
+        self.ring = deque(maxlen=size)
+        self.queue = Queue() if logfile else None
+        self.thread = None
+
+    def start(self):
+        if self.queue is not None and self.thread is None:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def configure(self, level, sample=None):
+        if isinstance(level, basestring):
+            level = LEVELS.index(level)
+        self.level = level
+        if sample is not None:
+            self.sample = max(0.0, min(1.0, sample))
+
+    def wants(self, failed):
+        """Decides whether the operation that just finished is recorded."""
+        if failed:
+            return self.level >= ERROR
+        return self.level >= INFO and (self.sample >= 1.0 or
+                                       random.random() < self.sample)
+
+    def record(self, op, path, latency, trips, err, detail=None):
+        entry = (time.time(), op, path, latency, trips, err, detail)
+        self.ring.append(entry)
+        if self.queue is not None:
+            self.queue.put(entry)
+
+    def format(self, entry):
+        stamp, op, path, latency, trips, err, detail = entry
+        line = '%.6f %s %s %.3fms rt=%d err=%d' % (
+            stamp, op, path, latency * 1000, trips, err)
+        if detail:
+            line += ' ' + detail
+        return line
+
+    def _run(self):
+        with open(self.logfile, 'a') as log:
+            while True:
+                entry = self.queue.get()
+                log.write(self.format(entry) + '\n')
+                if self.queue.empty():
+                    log.flush()
+
+class TracingMixIn:
+    """Drop-in replacement for fuse.LoggingMixIn.  When tracing is off the
+       only cost is one attribute check per call.  The first argument of
+       the operation (a path, or an inode for the low level API) is recorded
+       as its target."""
+
+    tracer = None
+
+    def __call__(self, op, *args):
+        tracer = self.tracer
+        if tracer is None or not tracer.level:
+            return getattr(self, op)(*args)
+
+        _local.roundtrips = 0
+        err = 0
+        ret = None
+        start = time.time()
+        try:
+            ret = getattr(self, op)(*args)
+            return ret
+        except OSError, e:
+            err = e.errno or EFAULT
+            raise
+        except:
+            err = EFAULT
+            raise
+        finally:
+            latency = time.time() - start
+            if tracer.wants(err):
+                detail = None
+                if tracer.level >= DEBUG:
+                    detail = 'args=%.200r' % (args[1:],)
+                    if isinstance(ret, (str, list, dict)):
+                        detail += ' ret=%d' % len(ret)
+                tracer.record(op, args[0] if args else '-', latency,
+                              _local.roundtrips, err, detail)
+
+class TraceFile:
+    """The /.trace control file.  Reading it shows the current settings
+       followed by the most recent records; writing 'level [sample]' changes
+       them."""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def getattr(self):
+        now = time.time()
+        return {
+            'st_mode' : (S_IFREG | 0644),
+            'st_nlink' : 1,
+            'st_size' : len(self.read()),
+            'st_ctime' : now,
+            'st_mtime' : now,
+            'st_atime' : now
+            }
+
+    def read(self):
+        tracer = self.tracer
+        lines = ['level=%s sample=%g' % (LEVELS[tracer.level], tracer.sample)]
+        lines += [tracer.format(entry) for entry in list(tracer.ring)]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, data, offset):
+        words = data.split()
+        try:
+            self.tracer.configure(words[0],
+                                  float(words[1]) if len(words) > 1 else None)
+        except (IndexError, ValueError):
+            raise FuseOSError(EINVAL)
+        return len(data)
+
+    def readdir(self):
+        raise FuseOSError(ENOTDIR)
@@ -0,0 +1,86 @@
+# Filename <-> _id round trips
+#
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import uuid
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from bson.son import SON
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'humongoufs'))
+
+import ids
+
+OID = ObjectId('507f1f77bcf86cd799439011')
+
+class RoundTripTest(unittest.TestCase):
+
+    def assertRoundTrip(self, _id):
+        name = ids.encode(_id)
+        self.assertNotIn('/', name)
+        self.assertNotIn('\x00', name)
+        self.assertEqual(ids.decode(name), _id)
+        self.assertIs(type(ids.decode(name)), type(_id))
+        return name
+
+    def test_objectid(self):
+        self.assertEqual(self.assertRoundTrip(OID), str(OID))
+
+    def test_strings(self):
+        for _id in [u'readme', u'a/b%c', u'nul\x00byte', u'caf\xe9']:
+            self.assertRoundTrip(_id)
+
+    def test_ambiguous_strings(self):
+        for _id in [u'', u'.', u'..', unicode(OID), u'~i~1', u'~s~x']:
+            self.assertTrue(self.assertRoundTrip(_id).startswith('~s~'))
+
+    def test_str_and_unicode(self):
+        # The driver hands strings back as unicode, so both spell one name
+        self.assertEqual(ids.encode('readme'), ids.encode(u'readme'))
+        self.assertEqual(ids.encode(u'caf\xe9'.encode('utf-8')),
+                         ids.encode(u'caf\xe9'))
+        self.assertEqual(ids.decode(ids.encode('readme')), u'readme')
+        self.assertIs(type(ids.decode(ids.encode('readme'))), unicode)
+
+    def test_numbers(self):
+        for _id in [0, 42, -7, 2 ** 40]:
+            self.assertRoundTrip(_id)
+        self.assertEqual(ids.decode(ids.encode(2 ** 70)), 2 ** 70)
+        self.assertNotEqual(ids.encode(True), ids.encode(1))
+
+    def test_uuid(self):
+        self.assertRoundTrip(uuid.UUID('12345678123456781234567812345678'))
+
+    def test_binary(self):
+        for _id in [Binary('ab\x00/'), Binary('\xff\x00', 5), Binary('')]:
+            name = self.assertRoundTrip(_id)
+            self.assertEqual(ids.decode(name).subtype, _id.subtype)
+        # Binary is a str, but not the same _id as the string
+        self.assertNotEqual(ids.encode(Binary('readme')), ids.encode('readme'))
+        self.assertEqual(ids.idtype(Binary('x')), 'binary')
+
+    def test_bad_binary(self):
+        for name in ['~b~0.abc', '~b~0.zz', '~b~x.00', '~b~00']:
+            self.assertRaises(ValueError, ids.decode, name)
+
+    def test_compound(self):
+        compound = SON([('z', 1), ('a', OID),
+                        ('m', SON([('y', 'x/y'), ('b', 2)]))])
+        name = self.assertRoundTrip(compound)
+        # The order of a compound _id's fields is part of its value
+        self.assertEqual(list(ids.decode(name)), ['z', 'a', 'm'])
+        self.assertEqual(list(ids.decode(name)['m']), ['y', 'b'])
+        self.assertEqual(ids.encode(ids.decode(name)), name)
+        self.assertNotEqual(name, ids.encode(SON(reversed(compound.items()))))
+        self.assertEqual(ids.idtype(compound), 'compound')
+
+    def test_unknown_tag(self):
+        self.assertRaises(ValueError, ids.decode, '~q~1')
+
+if __name__ == '__main__':
+    unittest.main()